@@ -1,58 +1,163 @@
 import cv2
 import numpy as np
 
+PRIMARY_COLOR = (215, 167, 47)
+SECONDARY_COLOR = (255, 224, 148)
+TEXT_COLOR = (255, 255, 255)
+OPACITY_COLOR = (215, 167, 47)
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+FONT_SCALE = 0.5
+
+
+def plot_object(image, obj: dict, label: str, primary_color=PRIMARY_COLOR, secondary_color=SECONDARY_COLOR,
+                text_color=TEXT_COLOR, opacity_color=OPACITY_COLOR):
+    min_dim = min(obj['height'], obj['width'])
+
+    corner_size = max(15, min_dim / 5.33333)
+
+    x = int(obj['x'])
+    y = int(obj['y'])
+    w = int(obj['width'])
+    h = int(obj['height'])
+
+    # Add Rectangle
+    cv2.rectangle(image, (x, y), (x+w, y+h), opacity_color, -1)
+
+    # Add corners
+    corners = [(x, y), (x, y+h-int(corner_size)), (x+w-int(corner_size), y), (x+w-int(corner_size), y+h-int(corner_size))]
+    for corner in corners:
+        cv2.rectangle(image, corner, (corner[0]+int(corner_size), corner[1]+int(corner_size)), primary_color, 1)
+
+    padding = max(min_dim * .02, 5)
+    corner_size = corner_size - padding
+
+    # Add inner corners
+    corners = [(x+int(padding), y+int(padding)), (x+int(padding), y+h-int(padding)-int(corner_size)),
+               (x+w-int(padding)-int(corner_size), y+int(padding)), (x+w-int(padding)-int(corner_size), y+h-int(padding)-int(corner_size))]
+    for corner in corners:
+        cv2.rectangle(image, corner, (corner[0]+int(corner_size), corner[1]+int(corner_size)), secondary_color, 1)
+
+    # Add text
+    cv2.putText(image, label, (x + 10 + int(padding), y + 10 + int(padding)), FONT, FONT_SCALE, text_color, 1)
+
+
+def object_bounds(obj: dict, label: str):
+    # the (x0, y0, x1, y1) that plot_object may draw on, the box and its label, which can be wider than the box
+    x = int(obj['x'])
+    y = int(obj['y'])
+    w = int(obj['width'])
+    h = int(obj['height'])
+
+    corner_size = int(max(15, min(obj['height'], obj['width']) / 5.33333))
+    padding = int(max(min(obj['height'], obj['width']) * .02, 5))
+    (text_width, text_height), baseline = cv2.getTextSize(label, FONT, FONT_SCALE, 1)
+
+    x0 = min(x, x + w - corner_size)
+    y0 = min(y, y + h - corner_size, y + 10 + padding - text_height)
+    x1 = max(x + w, x + corner_size, x + 10 + padding + text_width)
+    y1 = max(y + h, y + corner_size, y + 10 + padding + baseline)
+
+    return x0 - 1, y0 - 1, x1 + 2, y1 + 2
+
+
+def merge_rects(rects):
+    # merges the overlapping (x0, y0, x1, y1) rects until none overlap, so no pixel is blended twice
+    rects = list(rects)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(rects)):
+            for j in range(i + 1, len(rects)):
+                a, b = rects[i], rects[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    rects[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                    del rects[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return rects
+
+
+def object_label(obj: dict) -> str:
+    label = obj['classLabel']
+    if label == 'person':
+        if 'objects' in obj:
+            for f in obj['objects']:
+                if 'classLabel' in f and f['classLabel'] == 'face':
+                    if 'classes' in f:
+                        for c in f['classes']:
+                            if 'classLabel' in c:
+                                if c['confidence'] == 1:
+                                    label = label + "\n" + c['classLabel']
+                                else:
+                                    label = label + "\n" + c['classLabel'] + f" {c['confidence'] * 100:.0f}%" + ""
+    return label
+
+
 class EyePopPlotCV2:
     def __init__(self, frame):
         self.frame = frame.copy()
 
     def object(self, obj: dict):
-        label = self._label(obj)
-        min_dim = min(obj['height'], obj['width'])
+        plot_object(self.frame, obj, self._label(obj))
 
-        corner_size = max(15, min_dim / 5.33333)
+    def _label(self, obj: dict) -> str:
+        return object_label(obj)
 
-        primary_color = (215, 167, 47)
-        secondary_color = (255, 224, 148)
-        text_color = (255, 255, 255)
 
-        opacity_color = (215, 167, 47)
+class EyePopOverlayCV2:
+    # Draws the objects of a result blended 50% over frames, like blending an EyePopPlotCV2 frame with the original
+    #   one, but only the pixels the objects cover are blended. The drawn objects are kept in buffers that are
+    #   reused between frames and only redrawn when the result changes. The boxes match EyePopPlotCV2 exactly, the
+    #   antialiased label pixels that stick out of a box are blended without antialiasing.
 
-        x = int(obj['x'])
-        y = int(obj['y'])
-        w = int(obj['width'])
-        h = int(obj['height'])
+    def __init__(self, opacity=0.5):
+        self.opacity = opacity
+        self.result = None
+        self.overlay = None
+        self.mask = None
+        self.rects = []
 
-        # Add Rectangle
-        cv2.rectangle(self.frame, (x, y), (x+w, y+h), opacity_color, -1)
+    def update(self, result: dict, frame):
+        # redraws the overlay when the result, or the size of the frames, changed since the last call
+        if result is self.result and self.overlay is not None and self.overlay.shape == frame.shape \
+                and self.overlay.dtype == frame.dtype:
+            return
 
-        # Add corners
-        corners = [(x, y), (x, y+h-int(corner_size)), (x+w-int(corner_size), y), (x+w-int(corner_size), y+h-int(corner_size))]
-        for corner in corners:
-            cv2.rectangle(self.frame, corner, (corner[0]+int(corner_size), corner[1]+int(corner_size)), primary_color, 1)
+        if self.overlay is None or self.overlay.shape != frame.shape or self.overlay.dtype != frame.dtype:
+            self.overlay = np.zeros_like(frame)
+            self.mask = np.zeros(frame.shape[:2], dtype=np.uint8)
+        else:
+            for x0, y0, x1, y1 in self.rects:
+                self.overlay[y0:y1, x0:x1] = 0
+                self.mask[y0:y1, x0:x1] = 0
 
-        padding = max(min_dim * .02, 5)
-        corner_size = corner_size - padding
+        height, width = frame.shape[:2]
+        rects = []
+        for obj in result.get('objects', []):
+            label = object_label(obj)
+            plot_object(self.overlay, obj, label)
+            plot_object(self.mask, obj, label, 255, 255, 255, 255)
 
-        # Add inner corners
-        corners = [(x+int(padding), y+int(padding)), (x+int(padding), y+h-int(padding)-int(corner_size)), 
-                   (x+w-int(padding)-int(corner_size), y+int(padding)), (x+w-int(padding)-int(corner_size), y+h-int(padding)-int(corner_size))]
-        for corner in corners:
-            cv2.rectangle(self.frame, corner, (corner[0]+int(corner_size), corner[1]+int(corner_size)), secondary_color, 1)
+            x0, y0, x1, y1 = object_bounds(obj, label)
+            x0, y0 = max(x0, 0), max(y0, 0)
+            x1, y1 = min(x1, width), min(y1, height)
+            if x0 < x1 and y0 < y1:
+                rects.append((x0, y0, x1, y1))
 
-        # Add text
-        cv2.putText(self.frame, label, (x + 10 + int(padding), y + 10 + int(padding)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1)
+        self.rects = merge_rects(rects)
+        for x0, y0, x1, y1 in self.rects:
+            mask = self.mask[y0:y1, x0:x1]
+            cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY, dst=mask)
 
-    def _label(self, obj: dict) -> str:
-        label = obj['classLabel']
-        if label == 'person':
-            if 'objects' in obj:
-                for f in obj['objects']:
-                    if 'classLabel' in f and f['classLabel'] == 'face':
-                        if 'classes' in f:
-                            for c in f['classes']:
-                                if 'classLabel' in c:
-                                    if c['confidence'] == 1:
-                                        label = label + "\n" + c['classLabel']
-                                    else:
-                                        label = label + "\n" + c['classLabel'] + f" {c['confidence'] * 100:.0f}%" + ""
-        return label
+        self.result = result
+
+    def draw(self, frame):
+        # blends the overlay into the drawn pixels of `frame`, in place
+        for x0, y0, x1, y1 in self.rects:
+            roi = frame[y0:y1, x0:x1]
+            blended = cv2.addWeighted(roi, 1 - self.opacity, self.overlay[y0:y1, x0:x1], self.opacity, 0)
+            cv2.copyTo(blended, self.mask[y0:y1, x0:x1], roi)
+        return frame
@@ -1,12 +1,27 @@
 from eyepop import EyePopSdk, Job
-from EyePopPlotCV2 import EyePopPlotCV2
+from EyePopPlotCV2 import EyePopOverlayCV2
 
 import numpy as np
 import cv2
 from mss import mss
-import os
+import io
+import threading
+import time
 
 SCREEN_NUMBER = 1
+# the (left, top, width, height) of the part of the screen to capture, relative to the screen, None for all of it
+CAPTURE_REGION = None
+# the scale of the captured frames, eg. 0.5 to analyze and display a 5K screen at half its size
+CAPTURE_SCALE = 1.0
+# infer the latest captured frame continuously in the background, instead of when space is pressed
+CONTINUOUS = False
+# seconds between reports of the capture, inference and display rates in continuous mode
+RATE_REPORT_INTERVAL = 2.0
+# in continuous mode only frames that differ from the last inferred one are sent, False sends every frame
+CHANGE_DETECTION = True
+# the jpeg quality (0-100) and scale of the frames uploaded to EyePop API, lower values upload fewer bytes
+UPLOAD_QUALITY = 80
+UPLOAD_SCALE = 1.0
 POP_UUID, POP_API_SECRET = "", ""
 
 def get_config_data():
@@ -22,6 +37,137 @@ def get_config_data():
         return uuid, secret
 
 
+def capture_area(monitor, region=None):
+    """
+    Returns the mss area of `region`, a (left, top, width, height) relative to `monitor`, clamped to the monitor.
+    Returns the whole monitor without a region.
+    """
+    if region is None:
+        return monitor
+
+    left, top, width, height = region
+    left = min(max(left, 0), monitor['width'] - 1)
+    top = min(max(top, 0), monitor['height'] - 1)
+
+    return {
+        'left': monitor['left'] + left,
+        'top': monitor['top'] + top,
+        'width': min(width, monitor['width'] - left),
+        'height': min(height, monitor['height'] - top),
+    }
+
+
+def encode_frame(frame, quality=UPLOAD_QUALITY, scale=UPLOAD_SCALE):
+    """
+    Encodes a frame as jpeg in memory, downscaled by `scale` first when it is below 1. The alpha channel of a
+    captured BGRA frame is dropped here, after downscaling, so only the frames that are uploaded pay for it.
+    Returns the encoded bytes as a numpy buffer.
+    """
+    if scale < 1.0:
+        frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    if frame.ndim == 3 and frame.shape[2] == 4:
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
+
+    success, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+
+    if not success:
+        raise ValueError("Could not encode the frame as jpeg")
+
+    return buffer
+
+
+def scale_result(result, factor):
+    """
+    Scales the coordinates of the objects in a prediction result, and of the objects nested in them, in place.
+    Used to map the results of a downscaled upload back onto the captured frame.
+    """
+    for key in ('x', 'y', 'width', 'height', 'source_width', 'source_height'):
+        if key in result:
+            result[key] = result[key] * factor
+
+    for obj in result.get('objects', []):
+        scale_result(obj, factor)
+
+    return result
+
+
+class RateCounter:
+
+    """
+    Counts events, eg. captured frames, and measures how many happened per second between two updates.
+    """
+
+    def __init__(self):
+
+        self.count = 0
+        self.start = time.perf_counter()
+        self.rate = 0.0
+
+    def tick(self):
+
+        self.count += 1
+
+    def update(self):
+
+        now = time.perf_counter()
+
+        if now > self.start:
+
+            self.rate = self.count / (now - self.start)
+
+        self.count = 0
+        self.start = now
+
+
+class ChangeDetector:
+
+    """
+    Decides whether a frame changed enough since the last frame it let through to be worth inferring again.
+
+    Frames are compared on a thumbnail sampled every `step` pixels, a sample changed when any of its channels
+    differs by more than `pixel_threshold`. A frame is new when more than `min_changed` of the samples changed.
+    Sampling rather than averaging keeps the check to a few tens of microseconds on a 1080p frame.
+    """
+
+    def __init__(self, step=8, pixel_threshold=16, min_changed=0.0005):
+
+        self.step = step
+        self.pixel_threshold = pixel_threshold
+        self.min_changed = min_changed
+        self.reference = None
+        self.sent = 0
+        self.skipped = 0
+
+    def thumbnail(self, frame):
+
+        height, width = frame.shape[:2]
+
+        return cv2.resize(frame, (max(width // self.step, 1), max(height // self.step, 1)),
+                          interpolation=cv2.INTER_NEAREST)
+
+    def changed(self, frame):
+
+        """
+        Returns whether `frame` changed since the last frame that changed, and counts it as sent or skipped.
+        """
+
+        thumbnail = self.thumbnail(frame)
+
+        if self.reference is not None and self.reference.shape == thumbnail.shape:
+
+            difference = cv2.absdiff(thumbnail, self.reference)
+
+            if np.count_nonzero(difference > self.pixel_threshold) <= self.min_changed * difference.size:
+
+                self.skipped += 1
+                return False
+
+        # compare the next frames to the last one sent, so slow changes still add up to a new frame
+        self.reference = thumbnail
+        self.sent += 1
+        return True
+
 
 class ScreenCaptureAnalyzer:
 
@@ -30,122 +176,315 @@ class ScreenCaptureAnalyzer:
 
     Attributes:
         sct (mss): The mss object for capturing screen.
-        monitor (dict): The monitor information for capturing screen.
+        monitor (dict): The area of the screen to capture, the whole monitor or the capture region in it.
+        capture_scale (float): The scale of the captured frames.
         result (dict): The result of the prediction from EyePop API.
         frame (numpy.ndarray): The captured frame from the screen.
-        ep_cv2_plotter (EyePopPlot): The object for plotting the detected objects on the frame.
+        ep_cv2_plotter (EyePopOverlayCV2): The object for plotting the detected objects on the frame, it keeps the
+            drawn objects until the result changes.
+        continuous (bool): Whether a background worker infers the latest captured frame continuously.
+        rates (dict): The capture, inference and display RateCounters of continuous mode.
+        change_detector (ChangeDetector): Skips the unchanged frames in continuous mode, None to send every frame.
+        encode_time (float): The seconds taken to encode the last uploaded frame.
+        upload_time (float): The seconds taken to upload the last frame and get its prediction results.
+        upload_bytes (int): The size of the last uploaded frame.
 
     Methods:
         draw_results(): Draws the detected objects on the frame and returns the blended frame.
-        capture_screen(): Captures the screen and converts it to a numpy array.
+        capture_screen(): Captures the screen, or the capture region of it, as a BGRA numpy array.
         get_prediction_results(endpoint): Uploads the captured frame to EyePop API and gets the prediction results.
+        submit_frame(): Copies the captured frame to the inference worker when it is idle and the screen changed.
+        inference_worker(endpoint): Infers the frames handed to it until the analyzer stops.
+        report_rates(): Prints the capture, inference and display rates.
+        upload_report(): Returns the encode and upload times and the size of the last upload.
         run(): Runs the screen capture and analysis loop.
     """
 
-    def __init__(self, monitor_id):
+    def __init__(self, monitor_id, continuous=False, upload_quality=UPLOAD_QUALITY, upload_scale=UPLOAD_SCALE,
+                 region=CAPTURE_REGION, capture_scale=CAPTURE_SCALE, change_detection=CHANGE_DETECTION):
 
         """
         Initializes a new instance of the ScreenCaptureAnalyzer class.
 
         Args:
             monitor_id (int): The ID of the monitor to capture the screen from.
+            continuous (bool): Infer the latest captured frame continuously instead of when space is pressed.
+            upload_quality (int): The jpeg quality of the uploaded frames.
+            upload_scale (float): The scale of the uploaded frames, eg. 0.5 uploads them at half their size.
+            region (tuple, optional): The (left, top, width, height) of the part of the monitor to capture.
+            capture_scale (float): The scale of the captured frames.
+            change_detection (bool): Only infer the frames that changed since the last inferred one in
+                continuous mode, the last result is kept for the others.
         """
 
         self.sct = mss()
-        self.monitor = self.sct.monitors[monitor_id]
+        self.monitor = capture_area(self.sct.monitors[monitor_id], region)
+        self.capture_scale = capture_scale
 
         self.result = None
         self.frame = None
-        self.ep_cv2_plotter = None
-        self.temp_file = 'temp.jpg'
+        self.ep_cv2_plotter = EyePopOverlayCV2()
+
+        self.upload_quality = upload_quality
+        self.upload_scale = upload_scale
+        self.encode_time = 0.0
+        self.upload_time = 0.0
+        self.upload_bytes = 0
+
+        self.continuous = continuous
+        self.running = False
+
+        # the worker's own copy of the frame it infers, so the displayed frames can be drawn on in place
+        self.worker_frame = None
+        self.worker_idle = True
+        self.unsent_change = True
+        self.worker_lock = threading.Lock()
+        self.frame_ready = threading.Event()
+
+        self.rates = {'capture': RateCounter(), 'inference': RateCounter(), 'display': RateCounter()}
+        self.dropped_frames = 0
+        self.inference_latency = 0.0
+        self.change_detector = ChangeDetector() if change_detection else None
 
     def draw_results(self):
 
         """
-        Draws the detected objects on the frame and returns the blended frame.
+        Draws the detected objects on the frame and returns the blended frame. Only the pixels of the objects are
+        blended, in place, the inference worker has its own copy of the frames it uploads.
 
         Returns:
             numpy.ndarray: The blended frame with the detected objects.
         """
 
-        if self.result is None:
+        # the inference worker may replace the result at any time, so use it through one reference
+        result = self.result
+
+        if result is None:
             
             return self.frame
         
-        if "objects" not in self.result:
+        if "objects" not in result:
 
             return self.frame
 
-        self.ep_cv2_plotter = EyePopPlotCV2(self.frame)
-
-        for obj in self.result['objects']:
-
-            self.ep_cv2_plotter.object(obj)
-        
-        # Blend the original frame and the frame with objects
-        blended_frame = cv2.addWeighted(self.frame, 0.5, self.ep_cv2_plotter.frame, 0.5, 0)
+        # only redraws the objects when the result changed
+        self.ep_cv2_plotter.update(result, self.frame)
 
-        return blended_frame
+        return self.ep_cv2_plotter.draw(self.frame)
 
     def capture_screen(self):
 
         """
-        Captures the screen and converts it to a numpy array.
+        Captures the screen, or the capture region of it, as a BGRA numpy array downscaled by the capture scale.
         """
 
-        # get the screen shot of the monitor and convert it to a numpy array
-        self.frame = self.sct.grab(self.monitor)
-        self.frame = np.array(self.frame)
+        # wrap the pixels of the screen shot without copying them, every grab fills a new buffer so frames that
+        # are still waiting for inference or being displayed are never overwritten
+        screen_shot = self.sct.grab(self.monitor)
+        frame = np.frombuffer(screen_shot.raw, dtype=np.uint8).reshape(screen_shot.height, screen_shot.width, 4)
 
-    def get_prediction_results(self, endpoint):
+        if self.capture_scale < 1.0:
+
+            frame = cv2.resize(frame, None, fx=self.capture_scale, fy=self.capture_scale,
+                               interpolation=cv2.INTER_AREA)
+
+        self.frame = frame
+
+    def get_prediction_results(self, endpoint, frame=None):
 
         """
-        Uploads the captured frame to EyePop API and gets the prediction results.
+        Encodes the captured frame in memory, uploads it to EyePop API and gets the prediction results.
 
         Args:
             endpoint: The EyePop API endpoint.
+            frame (numpy.ndarray, optional): The frame to upload, defaults to the last captured frame.
 
         Raises:
             Exception: If there is an error uploading the frame or getting the prediction results.
         """
 
+        if frame is None:
+
+            frame = self.frame
+
         try:
 
-            cv2.imwrite(self.temp_file, self.frame)
-            self.result = endpoint.upload(self.temp_file).predict()
+            start = time.perf_counter()
+            buffer = encode_frame(frame, self.upload_quality, self.upload_scale)
+            encoded = time.perf_counter()
+
+            result = endpoint.upload_stream(io.BytesIO(buffer), 'image/jpeg').predict()
+            uploaded = time.perf_counter()
+
+            # map the results of a downscaled upload back onto the captured frame
+            if result is not None and self.upload_scale < 1.0:
+
+                scale_result(result, 1.0 / self.upload_scale)
+
+            self.result = result
+            self.encode_time = encoded - start
+            self.upload_time = uploaded - encoded
+            self.upload_bytes = len(buffer)
 
         except Exception as e:
 
             print ("Error uploading frame or getting prediction results: " + str(e))
 
+    def submit_frame(self):
+
+        """
+        Copies the captured frame into the inference worker's buffer when the worker is idle. The frames captured
+        while it is busy are dropped, so the worker always gets the most recent frame and only the frames it infers
+        are copied. Frames are only handed over after the screen changed, the others keep the last result.
+        """
+
+        if self.change_detector is None or self.change_detector.changed(self.frame):
+
+            self.unsent_change = True
+
+        if not self.unsent_change:
+
+            return
+
+        with self.worker_lock:
+
+            if not self.worker_idle:
+
+                self.dropped_frames += 1
+                return
+
+            if self.worker_frame is None or self.worker_frame.shape != self.frame.shape:
+
+                self.worker_frame = np.empty_like(self.frame)
+
+            np.copyto(self.worker_frame, self.frame)
+
+            self.worker_idle = False
+            self.unsent_change = False
+            self.frame_ready.set()
+
+    def inference_worker(self, endpoint):
+
+        """
+        Infers the frames copied into its buffer by submit_frame, one at a time, until the analyzer stops running.
+
+        Args:
+            endpoint: The EyePop API endpoint, only used by this worker while it runs.
+        """
+
+        while self.running:
+
+            if not self.frame_ready.wait(timeout=0.1):
+
+                continue
+
+            self.frame_ready.clear()
+
+            start = time.perf_counter()
+            self.get_prediction_results(endpoint, self.worker_frame)
+            self.inference_latency = time.perf_counter() - start
+
+            # the buffer is only written again once the worker is idle
+            with self.worker_lock:
+
+                self.worker_idle = True
+
+            self.rates['inference'].tick()
+
+    def report_rates(self):
+
+        """
+        Prints the capture, inference and display rates since the last report and shows them in the window title.
+        """
+
+        for rate in self.rates.values():
+
+            rate.update()
+
+        report = "capture {:.1f} fps, inference {:.1f} fps ({:.0f} ms), display {:.1f} fps, dropped {}".format(
+            self.rates['capture'].rate, self.rates['inference'].rate, self.inference_latency * 1000,
+            self.rates['display'].rate, self.dropped_frames)
+
+        if self.change_detector is not None:
+
+            report += ", sent {}, unchanged {}".format(self.change_detector.sent, self.change_detector.skipped)
+
+        print(report + ", " + self.upload_report())
+        cv2.setWindowTitle('screencap', report)
+
+    def upload_report(self):
+
+        """
+        Returns how long the last upload took to encode and to upload and predict, and how large it was.
+        """
+
+        return "encode {:.1f} ms, upload {:.0f} ms, {:.0f} KB".format(
+            self.encode_time * 1000, self.upload_time * 1000, self.upload_bytes / 1024)
+
     def run(self):
 
         """
-        Runs the screen capture and analysis loop.
+        Runs the screen capture and analysis loop. In continuous mode the frames are inferred by a background
+        worker, so the loop keeps capturing and displaying at full rate whatever the inference latency.
         """
 
         with EyePopSdk.endpoint(pop_id=POP_UUID, secret_key=POP_API_SECRET) as endpoint:
 
             cv2.namedWindow("screencap", cv2.WINDOW_NORMAL) 
 
-            # infinite loop to capture the screen and send to EyePop API
-            while True:
-            
-                self.capture_screen()
+            worker = None
+
+            if self.continuous:
+
+                self.running = True
+                worker = threading.Thread(target=self.inference_worker, args=(endpoint,), daemon=True)
+                worker.start()
+
+            last_report = time.perf_counter()
 
-                drawing = self.draw_results()
+            try:
+
+                # infinite loop to capture the screen and send to EyePop API
+                while True:
                 
-                cv2.imshow('screencap', drawing)
+                    self.capture_screen()
+                    self.rates['capture'].tick()
+
+                    if self.continuous:
+
+                        self.submit_frame()
+
+                    drawing = self.draw_results()
+                    
+                    cv2.imshow('screencap', drawing)
+                    self.rates['display'].tick()
 
-                # if the space key is pressed, upload the image to EyePop API
-                if cv2.waitKey(1) & 0xFF == ord(' '):
+                    # if the space key is pressed, upload the image to EyePop API
+                    if cv2.waitKey(1) & 0xFF == ord(' ') and not self.continuous:
 
-                    self.get_prediction_results(endpoint)
+                        # the displayed frame may have the objects drawn on it, so upload a fresh one
+                        self.capture_screen()
+                        self.get_prediction_results(endpoint)
+                        print(self.upload_report())
 
-                # if the window is closed, break the loop and close the window
-                if cv2.getWindowProperty('screencap', cv2.WND_PROP_VISIBLE) < 1:
+                    if self.continuous and time.perf_counter() - last_report >= RATE_REPORT_INTERVAL:
 
-                    break
+                        self.report_rates()
+                        last_report = time.perf_counter()
+
+                    # if the window is closed, break the loop and close the window
+                    if cv2.getWindowProperty('screencap', cv2.WND_PROP_VISIBLE) < 1:
+
+                        break
+
+            finally:
+
+                # let the worker finish its current frame before the endpoint closes
+                self.running = False
+
+                if worker is not None:
+
+                    worker.join()
 
     def dispose(self):
 
@@ -156,13 +495,11 @@ class ScreenCaptureAnalyzer:
         self.sct.close()
         cv2.destroyAllWindows()
 
-        if os.path.exists(self.temp_file):
-
-            os.remove(self.temp_file)
-
 
 POP_UUID, POP_API_SECRET = get_config_data()
-screen_capture_analyzer = ScreenCaptureAnalyzer(SCREEN_NUMBER)
+screen_capture_analyzer = ScreenCaptureAnalyzer(SCREEN_NUMBER, continuous=CONTINUOUS, upload_quality=UPLOAD_QUALITY,
+                                                upload_scale=UPLOAD_SCALE, region=CAPTURE_REGION,
+                                                capture_scale=CAPTURE_SCALE, change_detection=CHANGE_DETECTION)
 
 try:
     screen_capture_analyzer.run()
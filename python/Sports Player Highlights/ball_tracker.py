@@ -0,0 +1,127 @@
+import numpy as np
+
+import result_columns as rc
+
+# Tracks the sports ball detected by the "sports equipment" component of the pop and works out which player is
+#   closest to it in every frame, so highlights can follow possession instead of just presence.
+
+# the one word ball labels, the others end in ' ball', and 'baseball bat' or 'baseball glove' are not balls
+BALL_LABELS = {'basketball', 'football', 'baseball', 'volleyball', 'softball'}
+
+
+def is_ball_label(class_label):
+    """ Whether `class_label` names a ball, eg. 'sports ball' or 'soccer ball', but not 'baseball bat'. """
+    return class_label in BALL_LABELS or class_label.endswith(' ball')
+
+
+def ball_mask(columns):
+    """ The rows of `columns` that are a ball, see is_ball_label. """
+    is_ball = np.array([is_ball_label(class_label) for class_label in columns.class_labels] + [False])
+    return is_ball[columns.class_ids]
+
+
+class BallTrack:
+
+    def __init__(self, max_gap=1.0):
+        """
+        Args:
+            max_gap (float): The longest gap in seconds between two ball detections that is interpolated.
+                Frames in longer gaps have no ball.
+        """
+        self.max_gap = max_gap
+        self._times = []
+        self._boxes = []
+        self._track = None
+
+    def add(self, columns) -> None:
+        """ Adds the most confident ball of every frame in `columns`. """
+        rows = np.flatnonzero(ball_mask(columns))
+        if len(rows) == 0:
+            return
+
+        # order by time, most confident first, then keep the first row of each frame
+        rows = rows[np.lexsort((-columns.confidences[rows], columns.seconds[rows]))]
+        times = columns.seconds[rows]
+        first = np.concatenate(([True], times[1:] != times[:-1]))
+
+        self._times.append(times[first])
+        self._boxes.append(columns.boxes[rows[first]])
+        self._track = None
+
+    def __len__(self):
+        return sum(len(times) for times in self._times)
+
+    def track(self):
+        """ Returns the sorted (times, boxes) of the ball detections. """
+        if self._track is None:
+            times = np.concatenate(self._times) if self._times else np.empty(0)
+            boxes = np.concatenate(self._boxes) if self._boxes else np.empty((0, 4))
+            order = np.argsort(times, kind='stable')
+            self._track = times[order], boxes[order]
+
+        return self._track
+
+    def at_times(self, t):
+        """
+        Returns the (n, 4) ball box at each time in `t`, linearly interpolated across gaps of up to max_gap seconds.
+        The rows are nan where there is no ball.
+        """
+        t = np.asarray(t, dtype=np.float64)
+        times, boxes = self.track()
+
+        if len(times) == 0:
+            return np.full((len(t), 4), np.nan)
+
+        after = np.searchsorted(times, t)
+        before = np.clip(after - 1, 0, len(times) - 1)
+        after = np.clip(after, 0, len(times) - 1)
+
+        detected = times[after] == t
+        bridged = (times[before] <= t) & (t <= times[after]) & (times[after] - times[before] <= self.max_gap)
+
+        ball = np.stack([np.interp(t, times, boxes[:, i]) for i in range(4)], axis=-1)
+        ball[~(detected | bridged)] = np.nan
+        return ball
+
+
+def assign_possession(person_tracker, ball_track, source_width, source_height, possession_distance=0.15,
+                      expand_bounds=True):
+    """
+    Stores the distance to the ball of every detection of every player, and which detections are the player closest
+    to the ball in their frame, on each Track.
+
+    Args:
+        person_tracker (PersonTracker): The tracked players.
+        ball_track (BallTrack): The ball detections of the same video.
+        source_width (int): The width of the video.
+        source_height (int): The height of the video.
+        possession_distance (float): The furthest normalized distance from the ball the closest player may be to
+            have the ball.
+        expand_bounds (bool): Grow the bounds of the player with the ball to contain it.
+    """
+    tracks = list(person_tracker.people.values())
+    if not tracks:
+        return
+
+    sizes = [len(track) for track in tracks]
+    times = np.concatenate([track.seconds for track in tracks])
+    boxes = np.concatenate([track.boxes for track in tracks])
+
+    ball = ball_track.at_times(times)
+    distances = rc.ball_distances(boxes, ball, source_width, source_height)
+    has_distance = distances >= 0
+
+    # the closest detection to the ball in each frame comes first when ordered by time then distance
+    order = np.lexsort((np.where(has_distance, distances, np.inf), times))
+    ordered_times = times[order]
+    closest = np.zeros(len(times), dtype=bool)
+    closest[order[np.concatenate(([True], ordered_times[1:] != ordered_times[:-1]))]] = True
+
+    has_ball = closest & has_distance & (distances <= possession_distance)
+
+    if expand_bounds:
+        boxes = np.where(has_ball[:, None], rc.expand_to_ball(boxes, ball), boxes)
+
+    for track, start, end in zip(tracks, np.cumsum([0] + sizes[:-1]), np.cumsum(sizes)):
+        track.set_ball(distances[start:end], has_ball[start:end])
+        track.set_boxes(boxes[start:end])
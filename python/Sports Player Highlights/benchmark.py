@@ -0,0 +1,385 @@
+import argparse as ap
+import asyncio
+import contextlib
+import json
+import os
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import ball_tracker as bt
+import eyepop_manager as em
+import movie_maker as mm
+import person_tracker as pt
+import result_columns as rc
+import twod
+from synthetic import make_synthetic_video, make_segments, make_bounds, make_synthetic_results
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+
+def benchmark_decode(video_path, segments):
+    """ Reports decoded frames/sec for seek-per-frame against the single forward pass. """
+    for name, reader in [('seek every frame', mm.read_frames_seeking), ('sequential', mm.read_frames)]:
+        cap = cv2.VideoCapture(video_path)
+        frame_rate = cap.get(cv2.CAP_PROP_FPS)
+        frame_indices = [index for index, _ in mm.get_frame_schedule(segments, frame_rate)]
+
+        start = time.perf_counter()
+        frames = sum(1 for _ in reader(cap, frame_indices))
+        elapsed = time.perf_counter() - start
+        cap.release()
+
+        print(f"decode {name:>16}: {frames} frames in {elapsed:.2f}s, {frames / elapsed:.1f} frames/sec")
+
+
+def benchmark_batch_decode(video_path, player_segments):
+    """ Compares decoding each player's clip separately against one merged schedule, like create_videos. """
+    cap = cv2.VideoCapture(video_path)
+    frame_rate = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+
+    schedules = [[index for index, _ in mm.get_frame_schedule(segments, frame_rate)]
+                 for segments in player_segments]
+    merged = sorted(index for schedule in schedules for index in schedule)
+
+    for name, passes in [('per player', schedules), ('batched', [merged])]:
+        start = time.perf_counter()
+        frames = 0
+        for frame_indices in passes:
+            cap = cv2.VideoCapture(video_path)
+            frames += sum(1 for _ in mm.read_frames(cap, frame_indices))
+            cap.release()
+        elapsed = time.perf_counter() - start
+
+        print(f"{len(player_segments)} players {name:>10}: {frames} clip frames in {elapsed:.2f}s, {frames / elapsed:.1f} frames/sec")
+
+
+def benchmark_render(video_path, segments, workers):
+    """ Reports rendered frames/sec of the headless renderer with one and with `workers` compose threads. """
+    cap = cv2.VideoCapture(video_path)
+    frame_rate = cap.get(cv2.CAP_PROP_FPS)
+    duration = cap.get(cv2.CAP_PROP_FRAME_COUNT) / frame_rate
+    cap.release()
+
+    bounds = make_bounds(duration)
+    frames = len(mm.get_frame_schedule(segments, frame_rate))
+    for worker_count in sorted({1, workers}):
+        start = time.perf_counter()
+        mm.create_video(video_path, 'benchmark', segments, bounds, headless=True, workers=worker_count)
+        elapsed = time.perf_counter() - start
+
+        print(f"render {worker_count:>3} workers: {frames} frames in {elapsed:.2f}s, {frames / elapsed:.1f} frames/sec")
+
+
+def benchmark_background(repeat=50):
+    """ Reports the per-frame ms of each letterbox background mode at 1080p and 4K. """
+    output_rect = twod.get_rect(x=0, y=0, w=720, h=600)
+    rng = np.random.default_rng(0)
+
+    for width, height in [(1920, 1080), (3840, 2160)]:
+        frame = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+        frame_rect = twod.get_rect(x=0, y=0, w=width, h=height)
+        blur_rect = twod.get_rect_fit_inside_another_rect(inner_rect=output_rect, outer_rect=frame_rect)
+
+        outputs = {}
+        for background in ['full', 'fast']:
+            start = time.perf_counter()
+            for _ in range(repeat):
+                outputs[background] = mm.blur_background(frame, blur_rect, output_rect, background=background)
+            elapsed = time.perf_counter() - start
+
+            print(f"background {background:>4} {width}x{height}: {1000 * elapsed / repeat:.2f} ms/frame")
+
+        difference = np.abs(outputs['full'].astype(np.int16) - outputs['fast']).mean()
+        print(f"background mean abs difference {width}x{height}: {difference:.2f}")
+
+
+def legacy_add_results(person_tracker, results):
+    """ The original per object parse loop of main.py, kept as the baseline of benchmark_parse. """
+    for result in results:
+        if 'objects' not in result:
+            continue
+
+        for obj in result['objects']:
+            if obj['classLabel'] != 'person':
+                continue
+
+            labels = []
+            trace_id = None
+
+            if 'objects' in obj:
+                for child in obj['objects']:
+                    if child['classLabel'] == 'text' and 'labels' in child and len(child['labels']) > 0:
+                        labels.extend([label['label'] for label in child['labels']])
+
+            if 'traceId' in obj:
+                trace_id = obj['traceId']
+
+            if (trace_id == None and labels == []):
+                continue
+
+            person_tracker.add_person(labels=labels, trace_id=trace_id, frame_time=result['seconds'],
+                                      bounds=[obj['x'], obj['y'], obj['width'], obj['height']])
+
+
+def benchmark_parse(frames):
+    """ Times parsing `frames` synthetic results into the person tracker, per object loop against columnar. """
+    results = make_synthetic_results(frames)
+
+    start = time.perf_counter()
+    legacy_add_results(pt.PersonTracker(), results)
+    legacy = time.perf_counter() - start
+
+    start = time.perf_counter()
+    columns = [columns for columns in rc.iter_columns(results)]
+    parse = time.perf_counter() - start
+
+    person_tracker = pt.PersonTracker()
+    for batch in columns:
+        rc.add_to_tracker(person_tracker, batch)
+    columnar = time.perf_counter() - start
+
+    print(f"parse {frames} frames per object loop: {legacy:.2f}s, {frames / legacy:.0f} frames/sec")
+    print(f"parse {frames} frames columnar: {columnar:.2f}s ({parse:.2f}s flattening), {frames / columnar:.0f} frames/sec")
+
+
+class LocalJob:
+    """ Stands in for an EyePop job, predicting one synthetic result per frame after `latency` seconds. """
+
+    def __init__(self, path, latency):
+        cap = cv2.VideoCapture(path)
+        frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        cap.release()
+
+        self.results = make_synthetic_results(frames, fps=fps)
+        self.latency = latency
+        self.frame = 0
+
+    async def predict(self):
+        if self.frame >= len(self.results):
+            return None
+
+        await asyncio.sleep(self.latency)
+        self.frame += 1
+        return self.results[self.frame - 1]
+
+    async def cancel(self):
+        self.frame = len(self.results)
+
+
+class LocalEndpoint:
+    """ Stands in for an async EyePop endpoint, see eyepop_manager.sharded_inference. """
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    async def upload(self, path):
+        return LocalJob(path, self.latency)
+
+
+def local_endpoint(latency=0.005):
+    """ An endpoint_factory of LocalEndpoints, which infer `1 / latency` frames/sec each. """
+    @contextlib.asynccontextmanager
+    async def factory():
+        yield LocalEndpoint(latency)
+
+    return factory
+
+
+def benchmark_shards(video_path, shards, latency=0.005):
+    """ Times sharded_inference on local stand-in endpoints with one shard against `shards` shards. """
+    for shard_count in sorted({1, shards}):
+        start = time.perf_counter()
+        seconds = [result['seconds'] for result in em.sharded_inference(
+            video_path, shards=shard_count, endpoint_factory=local_endpoint(latency))]
+        elapsed = time.perf_counter() - start
+
+        in_order = all(earlier < later for earlier, later in zip(seconds, seconds[1:]))
+        print(f"inference {shard_count} shards: {len(seconds)} results in {elapsed:.2f}s, "
+              f"{len(seconds) / elapsed:.1f} frames/sec, in order: {in_order}")
+
+
+def measure(stage, items, unit, function, *args, trace_memory=True):
+    """
+    Runs `function` and reports its time, its throughput in `items` per second and, with `trace_memory`, the peak
+    memory it allocated. Tracing memory slows down stages that allocate many python objects, eg. parse.
+
+    Returns:
+        (object, dict): The result of `function` and the report of the stage.
+    """
+    if trace_memory:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - start
+
+    peak = None
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return result, {
+        'stage': stage,
+        'seconds': elapsed,
+        'items': items,
+        'unit': unit,
+        'per_second': items / elapsed if elapsed > 0 else None,
+        'peak_memory_bytes': peak,
+    }
+
+
+def max_rss_bytes():
+    """ The peak resident memory of the process, None where the resource module is not available. """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return max_rss if os.uname().sysname == 'Darwin' else max_rss * 1024
+
+
+def benchmark_pipeline(video_path, players=10, seconds=600, fps=30, render_frames=300, trace_memory=True):
+    """
+    Times every stage of main.py on `seconds` of synthetic results with `players` players, then renders and encodes
+    up to `render_frames` frames of the most detected player from `video_path`.
+
+    Returns:
+        dict: The configuration, a report per stage, see measure, and the peak resident memory.
+    """
+    results = make_synthetic_results(int(seconds * fps), people=players, fps=fps)
+    frames = len(results)
+    reports = []
+
+    def stage(name, items, unit, function, *args):
+        result, report = measure(name, items, unit, function, *args, trace_memory=trace_memory)
+        reports.append(report)
+        return result
+
+    columns = stage('parse', frames, 'frames', lambda: list(rc.iter_columns(results)))
+    detections = sum(len(batch) for batch in columns)
+    source_width, source_height = columns[0].source_width, columns[0].source_height
+
+    person_tracker = pt.PersonTracker(smoothing=.95, trace_conflict='vote')
+    ball_track = bt.BallTrack()
+
+    def add_people():
+        for batch in columns:
+            ball_track.add(batch)
+            rc.add_to_tracker(person_tracker, batch)
+
+    def consolidate():
+        person_tracker.consolidate_people()
+        for track in person_tracker.people.values():
+            track.sort()
+
+    stage('add_person', detections, 'detections', add_people)
+    stage('possession', detections, 'detections', bt.assign_possession, person_tracker, ball_track,
+          source_width, source_height)
+    stage('consolidate', detections, 'detections', consolidate)
+    stage('filter_times', detections, 'detections', person_tracker.filter_times, 2)
+    stage('segments', detections, 'detections', person_tracker.score_times, source_width, source_height)
+    stage('smoothing', detections, 'detections', person_tracker.smooth_bounds)
+
+    # render the most detected player's highlights that fall inside the video
+    cap = cv2.VideoCapture(video_path)
+    frame_rate = cap.get(cv2.CAP_PROP_FPS)
+    duration = cap.get(cv2.CAP_PROP_FRAME_COUNT) / frame_rate
+    frame_rect = twod.get_rect(x=0, y=0, w=cap.get(cv2.CAP_PROP_FRAME_WIDTH), h=cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    person = max(person_tracker.people.values(), key=len)
+    segments = [(start, min(end, duration)) for start, end in person.time_segments if start < duration]
+    schedule = mm.get_frame_schedule(segments or make_segments(duration), frame_rate)[:render_frames]
+
+    output_rect = twod.get_rect(x=0, y=0, w=720, h=600)
+    dst_rect = twod.get_rect(center_x=output_rect.center_x, center_y=output_rect.center_y,
+                             w=output_rect.min_dim - 20, h=output_rect.min_dim - 20)
+    blur_rect = twod.get_rect_fit_inside_another_rect(inner_rect=output_rect, outer_rect=frame_rect)
+    bounds = person.timeline().at_times([t for _, t in schedule])
+    layouts = list(zip(*[twod.to_rects(rects) for rects in mm.layout_rects(bounds, frame_rect)]))
+
+    def render():
+        frames = mm.read_frames(cap, [index for index, _ in schedule])
+        return [mm.compose_frame(frame, layout, output_rect, dst_rect, blur_rect)
+                for (_, frame), layout in zip(frames, layouts)]
+
+    def encode(composed):
+        os.makedirs('output', exist_ok=True)
+        sink = mm.open_sink(os.path.join('output', 'benchmark_encode.mp4'), (output_rect.w, output_rect.h), frame_rate)
+        for frame in composed:
+            sink.write(frame)
+        sink.close()
+
+    composed = stage('render', len(schedule), 'frames', render)
+    cap.release()
+    stage('encode', len(composed), 'frames', encode, composed)
+
+    return {
+        'config': {'players': players, 'seconds': seconds, 'fps': fps, 'frames': frames, 'detections': detections,
+                   'video': video_path, 'render_frames': len(schedule), 'trace_memory': trace_memory},
+        'stages': reports,
+        'max_rss_bytes': max_rss_bytes(),
+    }
+
+
+if __name__ == '__main__':
+    args = ap.ArgumentParser()
+    args.add_argument("--video", type=str, default=None, nargs='?')
+    args.add_argument("--seconds", type=float, default=60)
+    args.add_argument("--segments", type=int, default=10)
+    args.add_argument("--players", type=int, default=8)
+    args.add_argument("--workers", type=int, default=os.cpu_count())
+    args.add_argument("--parse_frames", type=int, default=100000)
+    args.add_argument("--shards", type=int, default=4)
+    args.add_argument("--pipeline_seconds", type=float, default=600)
+    args.add_argument("--json", type=str, default=None, nargs='?')
+    args.add_argument("--no_memory", action="store_true")
+    args.add_argument("--stages", type=str, nargs='*', default=['decode', 'render', 'background', 'parse', 'pipeline'],
+                      choices=['decode', 'render', 'background', 'parse', 'shards', 'pipeline'])
+    args = args.parse_args()
+
+    if 'parse' in args.stages:
+        benchmark_parse(args.parse_frames)
+
+    if not {'decode', 'render', 'background', 'shards', 'pipeline'} & set(args.stages):
+        exit()
+
+    video_path = args.video
+    if video_path is None:
+        video_path = 'benchmark_video.mp4'
+        if not os.path.exists(video_path):
+            print("Writing synthetic video", video_path)
+            make_synthetic_video(video_path, seconds=args.seconds)
+
+    cap = cv2.VideoCapture(video_path)
+    duration = cap.get(cv2.CAP_PROP_FRAME_COUNT) / cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+
+    if 'decode' in args.stages:
+        benchmark_decode(video_path, make_segments(duration, count=args.segments))
+        benchmark_batch_decode(video_path, [make_segments(duration, count=args.segments, seed=player)
+                                            for player in range(args.players)])
+
+    if 'render' in args.stages:
+        benchmark_render(video_path, make_segments(duration, count=args.segments), args.workers)
+
+    if 'background' in args.stages:
+        benchmark_background()
+
+    if 'shards' in args.stages:
+        benchmark_shards(video_path, args.shards)
+
+    if 'pipeline' in args.stages:
+        report = benchmark_pipeline(video_path, players=args.players, seconds=args.pipeline_seconds,
+                                    trace_memory=not args.no_memory)
+        print(json.dumps(report, indent=2))
+
+        if args.json:
+            with open(args.json, "w") as report_file:
+                json.dump(report, report_file, indent=2)
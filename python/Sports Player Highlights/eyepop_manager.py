@@ -2,14 +2,24 @@ from eyepop import EyePopSdk
 
 import os
 import asyncio
+import contextlib
 import logging
+import math
 import time
 import json
-import aiofiles
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from result_cache import ResultCache
 
 
 POP_UUID, POP_API_SECRET = '', ''
 
+EYEPOP_URL = 'https://api.eyepop.ai'
+
 
 def get_config_data():
     """
@@ -24,142 +34,599 @@ def get_config_data():
         return uuid, secret
 
 
-def get_inference_data(location, pop_id, timeout=None):
+# The pop run on every frame: person detection, deepsort tracing, text detection and PARSeq OCR on each person and
+#   sports equipment detection
+POP_COMP = """
+    ep_infer id=1
+    model=eyepop-person:EPPersonB1_Person_TorchScriptCuda_float32 threshold=0.8
+    ! ep_infer id=2
+    tracing=deepsort
+    model=legacy:reid-mobilenetv2_x1_4_ImageNet_TensorFlowLite_int8
+    secondary-to-id=1
+    secondary-for-class-ids=<0>
+    ! ep_infer id=3  category-name="text"
+    model=eyepop-text:EPTextB1_Text_TorchScriptCuda_float32 threshold=0.6
+    secondary-to-id=1
+    secondary-for-class-ids=<0>
+    ! ep_infer id=4 category-name="text"
+    secondary-to-id=3
+    model=PARSeq:PARSeq_TextDataset_TorchScriptCuda_float32 threshold=0.1
+    ! ep_infer id=5 category-name="sports equipment"
+    model=eyepop-sports:EPSportsB1_Sports_TorchScriptCuda_float32 threshold=0.55
+"""
+
+
+# The text models are not in the production manifest yet, see configure_endpoint
+MODEL_MANIFESTS = [
+    {
+        "authority": "PARSeq",
+        "manifest": "https://s3.amazonaws.com/models.eyepop.ai/releases/PARSeq/1.0.2/manifest.json",
+    },
+    {
+        "authority": "eyepop-text",
+        "manifest": "https://s3.amazonaws.com/models.eyepop.ai/releases/eptext/1.0.3/manifest.json",
+    },
+]
+
+MODEL_DEFINITIONS = [
+    {
+        'model_id': 'PARSeq:PARSeq',
+        'dataset': 'TextDataset',
+        'format': 'TorchScriptCuda',
+        'type': 'float32'
+    },
+    {
+        'model_id': 'eyepop-text:EPTextB1',
+        'dataset': 'Text',
+        'format': 'TorchScriptCuda',
+        'type': 'float32'
+    },
+]
+
+
+def pop_definition(analysis_fps=None):
+    """ Everything that changes the inference results, used to key the result cache. """
+    definition = [POP_COMP, MODEL_MANIFESTS, MODEL_DEFINITIONS]
+    if analysis_fps:
+        definition.append({'analysis_fps': analysis_fps})
+    return json.dumps(definition, sort_keys=True)
+
+
+def configure_endpoint(endpoint):
+    """ Loads the text models and sets the sports pop on the endpoint. """
+
+    #############################################################################################################
+    #
+    #  NOTE: The following code will soon no longer be needed as the text model is rolled out to production
+    #
+
+    # set manifest for PARSeq and eyepop-text
+    manifest = endpoint.get_manifest()
+    manifest.extend(MODEL_MANIFESTS)
+    endpoint.set_manifest(manifest)
+
+    # load the PARSeq and eyepop-text models
+    for inner_model_def in MODEL_DEFINITIONS:
+        endpoint.load_model(inner_model_def)
+
+    endpoint.set_pop_comp(POP_COMP)
+
+    #
+    #
+    #############################################################################################################
+
+
+async def configure_endpoint_async(endpoint):
+    """ configure_endpoint for the async endpoints used by sharded_inference. """
+    manifest = await endpoint.get_manifest()
+    manifest.extend(MODEL_MANIFESTS)
+    await endpoint.set_manifest(manifest)
+
+    for inner_model_def in MODEL_DEFINITIONS:
+        await endpoint.load_model(inner_model_def)
+
+    await endpoint.set_pop_comp(POP_COMP)
+
+
+@contextlib.asynccontextmanager
+async def eyepop_endpoint():
+    """ Opens and configures an async EyePop endpoint, the default endpoint_factory of sharded_inference. """
+    pop_id, secret_key = get_config_data()
+
+    async with EyePopSdk.endpoint(pop_id=pop_id, secret_key=secret_key, eyepop_url=EYEPOP_URL, is_async=True) as endpoint:
+        await configure_endpoint_async(endpoint)
+        yield endpoint
+
+
+def video_duration(location):
+    """ Returns the duration of the video in seconds. """
+    ffprobe_cmd = [
+        "ffprobe", "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "csv=p=0",
+        location
+    ]
+
+    return float(subprocess.run(ffprobe_cmd, check=True, capture_output=True, text=True).stdout.strip())
+
+
+def split_video(location, output_dir, shard_seconds, duration=None):
     """
-    Perform inference on the given video using the EyePop SDK.
+    Splits the video into shards of about `shard_seconds` without re-encoding, each shard starts at the first
+    keyframe after a multiple of `shard_seconds`. Only the first `duration` seconds are split when it is set.
+
+    Returns:
+        list: The (path, start, end) of every shard, the times are in seconds of the source video.
+    """
+    list_path = os.path.join(output_dir, "shards.csv")
+    shard_pattern = os.path.join(output_dir, "shard_%04d" + os.path.splitext(location)[1])
+
+    ffmpeg_cmd = ["ffmpeg", "-loglevel", "error", "-i", location]
+    if duration is not None:
+        ffmpeg_cmd += ["-t", str(duration)]
+    ffmpeg_cmd += [
+        "-map", "0", "-c", "copy",
+        "-f", "segment", "-segment_time", str(shard_seconds), "-reset_timestamps", "1",
+        "-segment_list", list_path, "-segment_list_type", "csv",
+        shard_pattern, "-y"
+    ]
+
+    subprocess.run(ffmpeg_cmd, check=True)
+
+    shards = []
+    with open(list_path, "r") as list_file:
+        for line in list_file:
+            if line.strip():
+                name, start, end = line.strip().rsplit(",", 2)
+                shards.append((os.path.join(output_dir, name), float(start), float(end)))
+
+    return shards
+
+
+class ShardSpool:
+    """
+    The results of one shard, written to an ndjson file as they arrive and read back in order, so the shards that
+    are waiting for the shards before them are held on disk instead of in memory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.writer = ResultWriter(path)
+        self.condition = threading.Condition()
+        self.written = 0
+        self.done = False
+
+    def put(self, result):
+        with self.condition:
+            self.writer.write(result)
+            self.writer.file.flush()
+            self.written += 1
+            self.condition.notify_all()
+
+    def close(self):
+        """ Marks the shard done, no more results are put after this. """
+        with self.condition:
+            if not self.done:
+                self.writer.close()
+                self.done = True
+                self.condition.notify_all()
+
+    def read(self):
+        """ Yields the results of the shard, waiting for new ones until it is closed. """
+        with open(self.path, "r") as data_file:
+            read = 0
+            while True:
+                with self.condition:
+                    while read == self.written and not self.done:
+                        self.condition.wait()
+
+                    if read == self.written:
+                        return
+                    written = self.written
+
+                # every counted line was flushed whole, so it can be read without the lock
+                for _ in range(written - read):
+                    yield json.loads(data_file.readline())
+                read = written
+
+
+async def infer_shards(shards, outputs, errors, stop, endpoint_factory=eyepop_endpoint, endpoints=4):
+    """
+    Infers every shard as its own job, running at most `endpoints` jobs at once on as many endpoints.
+    The results of each shard are put on its ShardSpool in `outputs` with their time in the source video, and
+    the spool is closed once the shard is done. Errors are added to `errors` before it is closed.
+    """
+    pool = asyncio.Queue()
+
+    async def infer(index, path, start):
+        endpoint = await pool.get()
+        try:
+            if stop.is_set():
+                return
+
+            job = await endpoint.upload(path)
+            while result := await job.predict():
+
+                # skip any empty results
+                if 'seconds' not in result:
+                    continue
+
+                shift_result(result, start)
+                outputs[index].put(result)
+
+                if stop.is_set():
+                    await job.cancel()
+                    break
+
+        except BaseException as e:
+            errors.append(e)
+            raise
+
+        finally:
+            pool.put_nowait(endpoint)
+            outputs[index].close()
+
+    async with contextlib.AsyncExitStack() as stack:
+        # connect the endpoints concurrently, each takes a while to load the pop
+        connected = await asyncio.gather(
+            *(stack.enter_async_context(endpoint_factory()) for _ in range(min(endpoints, len(shards)))))
+        for endpoint in connected:
+            pool.put_nowait(endpoint)
+
+        await asyncio.gather(*(infer(index, path, start) for index, (path, start, _) in enumerate(shards)))
+
+
+def sharded_inference(location, shards=4, endpoints=None, timeout=None, offset=0.0,
+                      endpoint_factory=eyepop_endpoint, work_dir=None, analysis_fps=None):
+    """
+    Perform inference on the given video split into `shards` time ranges that are inferred concurrently, and
+    yield every result in timestamp order.
+
+    The results of the first shard are yielded as they arrive, the later shards are spooled to disk until the
+    shards before them are done, so memory stays flat whatever the number of shards.
 
     Args:
         location (str): The location of the video to perform inference on.
+        shards (int): The number of time ranges the video is split into.
+        endpoints (int, optional): The most jobs inferred at once. Defaults to one per shard.
         timeout (int, optional): The maximum seconds of prediction data. Defaults to None, which means process all frames data.
+        offset (float, optional): Added to the time of every result, for videos cut out of a longer one.
+        endpoint_factory (callable, optional): Returns an async context manager of a configured endpoint,
+            eg. a local stand-in for testing. Defaults to eyepop_endpoint.
+        work_dir (str, optional): Where the shard files are written, defaults to the system temp folder.
+        analysis_fps (float, optional): Only infer this many frames per second, see resample_video.
+
+    Yields:
+        dict: The prediction of each frame, in timestamp order.
+    """
+    shard_dir = tempfile.mkdtemp(prefix="shards_", dir=work_dir)
+    stop = threading.Event()
+    worker = None
 
-    Raises:
-        Exception: If an error occurs during the inference process.
+    try:
+        if analysis_fps:
+            resampled_path = os.path.join(shard_dir, "analysis.mp4")
+            print("Resampling video to", analysis_fps, "fps")
+            resample_video(location, resampled_path, analysis_fps)
+            location = resampled_path
 
-    Returns:
-        None
+        duration = video_duration(location)
+        if timeout is not None:
+            duration = min(duration, timeout)
+
+        shard_list = split_video(location, shard_dir, math.ceil(duration / shards * 1000) / 1000, duration=duration)
+        shard_list = [(path, start + offset, end + offset) for path, start, end in shard_list]
+        print("Inferring", len(shard_list), "shards")
+
+        outputs = [ShardSpool(os.path.join(shard_dir, "shard_{:03d}.ndjson".format(index)))
+                   for index in range(len(shard_list))]
+        errors = []
+
+        def run():
+            try:
+                asyncio.run(infer_shards(shard_list, outputs, errors, stop, endpoint_factory=endpoint_factory,
+                                         endpoints=endpoints or len(shard_list)))
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                # unblock the shards that never started, eg. when an endpoint failed to connect
+                for output in outputs:
+                    output.close()
+
+        worker = threading.Thread(target=run, daemon=True)
+        worker.start()
+
+        last_seconds = None
+        for output in outputs:
+            for result in output.read():
+
+                # a frame on the boundary between two shards can be in both
+                if last_seconds is not None and result['seconds'] <= last_seconds:
+                    continue
+
+                last_seconds = result['seconds']
+                yield result
+
+            # never yield the shards after an incomplete one, the results would have a gap
+            if errors:
+                raise errors[0]
+
+    finally:
+        stop.set()
+        if worker is not None:
+            worker.join()
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+
+def resample_video(location, output_path, fps):
+    """
+    Re-encodes the video at `fps` frames per second, without audio, so only those frames are uploaded and
+    inferred. The frames keep their time in the video. A keyframe every two seconds keeps resuming and
+    sharding the resampled video precise.
+    """
+    ffmpeg_cmd = [
+        "ffmpeg", "-loglevel", "error", "-i", location,
+        "-vf", f"fps={fps}", "-an",
+        "-c:v", "libx264", "-preset", "ultrafast", "-crf", "18", "-g", str(max(1, round(2 * fps))),
+        output_path, "-y"
+    ]
+
+    subprocess.run(ffmpeg_cmd, check=True)
+
+
+@contextlib.contextmanager
+def analysis_video(location, analysis_fps=None, work_dir=None):
+    """ Yields the video to upload, `location` itself or a temporary copy resampled to `analysis_fps`. """
+    if not analysis_fps:
+        yield location
+        return
+
+    handle, path = tempfile.mkstemp(prefix="analysis_", suffix=".mp4", dir=work_dir)
+    os.close(handle)
+
+    try:
+        print("Resampling video to", analysis_fps, "fps")
+        resample_video(location, path, analysis_fps)
+        yield path
+    finally:
+        os.remove(path)
+
+
+def keyframe_before(location, seconds):
+    """ Returns the time of the last keyframe at or before `seconds`, 0 if there is none. """
+    ffprobe_cmd = [
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-skip_frame", "nokey",
+        "-show_entries", "frame=pts_time",
+        "-of", "csv=p=0",
+        "-read_intervals", f"{max(0.0, seconds - 30)}%{seconds + 0.001}",
+        location
+    ]
+
+    output = subprocess.run(ffprobe_cmd, check=True, capture_output=True, text=True).stdout
+    keyframes = [float(line.strip(',')) for line in output.split() if line.strip(',')]
+    keyframes = [keyframe for keyframe in keyframes if keyframe <= seconds]
+
+    return max(keyframes, default=0.0)
+
+
+def cut_video(location, output_path, start, end=None):
+    """
+    Copies the part of the video between `start` and `end` without re-encoding. `start` should be a keyframe
+    time, see keyframe_before, so the copy starts exactly there.
+    """
+    ffmpeg_cmd = ["ffmpeg", "-loglevel", "error", "-ss", str(start)]
+    if end is not None:
+        ffmpeg_cmd += ["-to", str(end)]
+    ffmpeg_cmd += ["-i", location, "-c", "copy", "-avoid_negative_ts", "make_zero", output_path, "-y"]
+
+    subprocess.run(ffmpeg_cmd, check=True)
+
+
+def stream_inference(location, timeout=None, offset=0.0, analysis_fps=None):
+    """
+    Perform inference on the given video using the EyePop SDK and yield every result as it arrives.
+
+    Args:
+        location (str): The location of the video to perform inference on.
+        timeout (int, optional): The maximum seconds of prediction data. Defaults to None, which means process all frames data.
+        offset (float, optional): Added to the time of every result, for videos cut out of a longer one.
+        analysis_fps (float, optional): Only infer this many frames per second, see resample_video.
+
+    Yields:
+        dict: The prediction of each frame, in timestamp order.
     """
     logging.basicConfig(level=logging.INFO)
     logging.getLogger('eyepop').setLevel(level=logging.DEBUG)
 
-    # EyePop SDK configuration
-    EYEPOP_POP_ID = ""
-    EYEPOP_SECRET_KEY = ""
-
     try:
         EYEPOP_POP_ID, EYEPOP_SECRET_KEY = get_config_data()
-    except (e):
-        print("Error reading EyePop credentials, ensure the eyepop_id.env and eyepop_secret.env files are present in the root directory.")
-        exit()
-
-    EYEPOP_URL = 'https://api.eyepop.ai'
-
-    with EyePopSdk.endpoint(pop_id=EYEPOP_POP_ID, secret_key=EYEPOP_SECRET_KEY, eyepop_url=EYEPOP_URL, is_async=False) as endpoint:
-
-        manifest = endpoint.get_manifest()
-
-        #############################################################################################################
-        #
-        #  NOTE: The following code will soon no longer be needed as the text model is rolled out to production
-        #
-
-        # set manifest for PARSeq
-        manifest.append(
-            {
-                "authority": "PARSeq",
-                "manifest": "https://s3.amazonaws.com/models.eyepop.ai/releases/PARSeq/1.0.2/manifest.json",
-            }
-        )
-
-        # set manifest for eyepop-text
-        manifest.append(
-            {
-                "authority": "eyepop-text",
-                "manifest": "https://s3.amazonaws.com/models.eyepop.ai/releases/eptext/1.0.3/manifest.json",
-            }
-        )
-
-        endpoint.set_manifest(manifest)
-
-        # load PARSeq model
-        inner_model_def = {
-            'model_id': 'PARSeq:PARSeq',
-            'dataset': 'TextDataset',
-            'format': 'TorchScriptCuda',
-            'type': 'float32'
-        }
+    except Exception as e:
+        raise RuntimeError("Error reading EyePop credentials, ensure the config file is present in the parent "
+                           "directory.") from e
 
-        endpoint.load_model(inner_model_def)
+    with analysis_video(location, analysis_fps) as source, \
+            EyePopSdk.endpoint(pop_id=EYEPOP_POP_ID, secret_key=EYEPOP_SECRET_KEY, eyepop_url=EYEPOP_URL, is_async=False) as endpoint:
 
-        # load eyepop-text model
-        inner_model_def = {
-            'model_id': 'eyepop-text:EPTextB1',
-            'dataset': 'Text',
-            'format': 'TorchScriptCuda',
-            'type': 'float32'
-        }
+        configure_endpoint(endpoint)
 
-        endpoint.load_model(inner_model_def)
+        # Upload video for inference
+        job = endpoint.upload(source)
 
-        endpoint.set_pop_comp(
-            """
-                ep_infer id=1
-                model=eyepop-person:EPPersonB1_Person_TorchScriptCuda_float32 threshold=0.8
-                ! ep_infer id=2
-                tracing=deepsort
-                model=legacy:reid-mobilenetv2_x1_4_ImageNet_TensorFlowLite_int8
-                secondary-to-id=1
-                secondary-for-class-ids=<0>
-                ! ep_infer id=3  category-name="text"
-                model=eyepop-text:EPTextB1_Text_TorchScriptCuda_float32 threshold=0.6
-                secondary-to-id=1
-                secondary-for-class-ids=<0>
-                ! ep_infer id=4 category-name="text"
-                secondary-to-id=3
-                model=PARSeq:PARSeq_TextDataset_TorchScriptCuda_float32 threshold=0.1
-                ! ep_infer id=5 category-name="sports equipment"
-                model=eyepop-sports:EPSportsB1_Sports_TorchScriptCuda_float32 threshold=0.55
-            """
-        )
-
-        #
-        #
-        #############################################################################################################
-
-        with open("data.json", "w") as data_file:
+        while result := job.predict():
 
-            try:
-                # Upload video for inference
-                job = endpoint.upload(location)
+            # skip any empty results
+            if 'seconds' not in result:
+                continue
+
+            if offset:
+                shift_result(result, offset)
+
+            yield result
+
+            #  stop job if timeout is reached
+            if timeout is not None and result['seconds'] > timeout:
+                job.cancel()
+                break
 
-                data_file.write("[")
+            print(result['seconds'])
 
-                while result := job.predict():
 
-                    # skip any empty results
-                    if 'seconds' not in result:
-                        continue
+def shift_result(result, offset):
+    """ Moves the result `offset` seconds later in the video. """
+    result['seconds'] += offset
+    if 'timestamp' in result:
+        # the timestamp is in nanoseconds
+        result['timestamp'] += int(offset * 1e9)
+
+
+def prefetch(results, max_queued=256):
+    """
+    Pulls `results` on a background thread so inference keeps running while the caller processes earlier results.
+    At most `max_queued` results are buffered, so memory stays flat however long the video is. Anything raised by
+    `results`, including SystemExit and KeyboardInterrupt, is raised again in the caller after the buffered results.
+    """
+    buffer = queue.Queue(maxsize=max_queued)
+    done = object()
+    errors = []
 
-                    # write the result to the data.json file
-                    data_file.write(json.dumps(
-                        result, indent=4, sort_keys=True))
+    def pump():
+        try:
+            for result in results:
+                buffer.put(result)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            buffer.put(done)
 
-                    data_file.write(",")
+    threading.Thread(target=pump, daemon=True).start()
 
-                    #  stop job if timeout is reached
-                    if timeout is not None and result['seconds'] > timeout:
-                        job.cancel()
+    while (result := buffer.get()) is not done:
+        yield result
 
-                    print(result['seconds'])
+    if errors:
+        raise errors[0]
+
+
+class ResultWriter:
+    """ Persists results as compact newline delimited json, one result per line. """
+
+    def __init__(self, path):
+        self.file = open(path, "w")
+
+    def write(self, result):
+        self.file.write(json.dumps(result, separators=(',', ':')))
+        self.file.write("\n")
+
+    def close(self):
+        self.file.close()
+
+
+def save_results(results, path):
+    """ Yields `results` unchanged while writing each of them to `path`. """
+    writer = ResultWriter(path)
+    try:
+        for result in results:
+            writer.write(result)
+            yield result
+    finally:
+        writer.close()
 
-                # remove the last comma
-                data_file.seek(data_file.tell() - 1, os.SEEK_SET)
-                data_file.truncate()
-                data_file.write("]")
 
-                data_file.close()
+def read_results(path):
+    """
+    Yields the results persisted at `path` one at a time. Reads newline delimited json, or the json array
+    of the older data.json files.
+    """
+    with open(path, "r") as data_file:
+
+        if path.endswith(".json"):
+            yield from json.load(data_file)
+            return
+
+        for line in data_file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def cached_inference(location, cache_dir="cache", timeout=None, shards=1, endpoints=None, analysis_fps=None):
+    """
+    Yields the results of `location`, inferring only what is not cached yet.
+
+    Results are cached per video content and pop definition. A completed analysis is read straight from the
+    cache. An interrupted one yields the cached results and then resumes inference at the keyframe before the
+    last cached timestamp, on a stream copy of the rest of the video. With more than one shard, what is left
+    is inferred with sharded_inference. Results at each `analysis_fps` are cached separately.
+    """
+    cache = ResultCache(cache_dir, location, pop_definition(analysis_fps))
+
+    yield from cache.read()
+
+    if cache.complete:
+        print("Using cached results", cache.path)
+        return
+
+    source = location
+    offset = 0.0
+    last_seconds = cache.last_seconds
+    resume_path = os.path.join(cache_dir, cache.key + "_resume" + os.path.splitext(location)[1])
+
+    try:
+        if last_seconds is not None:
+            offset = keyframe_before(location, last_seconds)
+            print("Resuming analysis at", offset, "seconds")
+            cut_video(location, resume_path, offset)
+            source = resume_path
+
+        if shards > 1:
+            results = sharded_inference(source, shards=shards, endpoints=endpoints, timeout=timeout, offset=offset,
+                                        work_dir=cache_dir, analysis_fps=analysis_fps)
+        else:
+            results = prefetch(stream_inference(source, timeout=timeout, offset=offset, analysis_fps=analysis_fps))
+
+        for result in results:
+
+            # the resumed video starts at a keyframe, skip what was already cached
+            if last_seconds is not None and result['seconds'] <= last_seconds:
+                continue
+
+            cache.append(result)
+            yield result
+
+        # only reached when the source finished without an error, a failed or abandoned analysis stays incomplete
+        #   so the next run resumes it instead of trusting the cache
+        if timeout is None:
+            cache.mark_complete()
+
+    finally:
+        cache.close()
+        if os.path.exists(resume_path):
+            os.remove(resume_path)
+
+
+def read_cached_results(location, cache_dir="cache", analysis_fps=None):
+    """ Yields the cached results of `location` without running any inference. """
+    yield from ResultCache(cache_dir, location, pop_definition(analysis_fps)).read()
+
+
+def get_inference_data(location, timeout=None, output_path="data.ndjson"):
+    """
+    Perform inference on the given video using the EyePop SDK and store all results in `output_path`.
+
+    Args:
+        location (str): The location of the video to perform inference on.
+        timeout (int, optional): The maximum seconds of prediction data. Defaults to None, which means process all frames data.
+        output_path (str, optional): The newline delimited json file the results are written to.
+
+    Returns:
+        None
+    """
+    try:
+        for _ in save_results(stream_inference(location, timeout=timeout), output_path):
+            pass
 
-            except Exception as e:
-                print('\n\n\n\n\n\n\n\n')
-                print(e)
-                print('\n\n\n\n\n\n\n\n')
-                data_file.close()
+    except Exception as e:
+        print('\n\n\n\n\n\n\n\n')
+        print(e)
+        print('\n\n\n\n\n\n\n\n')
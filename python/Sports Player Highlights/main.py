@@ -3,152 +3,110 @@ from eyepop import EyePopSdk
 import os
 import asyncio
 import logging
-import time
 import person_tracker as pt
-import json
 import argparse as ap
 
 import movie_maker as mm
 import eyepop_manager as em
+import result_columns as rc
+import ball_tracker as bt
 
 
-def main(video_file_path: str, target_jersey_number: str, analyze=False, smoothing=20, draw_bounds=False, debug=False):
+def main(video_file_path: str, target_jersey_number: str, analyze=False, smoothing=20, draw_bounds=False, debug=False, headless=False, workers=1, background='fast', trace_conflict='vote', results_path=None, save=True, cache_dir='cache', segments='possession', max_duration=60.0, shards=1, endpoints=None, analysis_fps=None, ocr_every=1):
 
     def upload_video(video_path: str):
         #
-        #  0. Obtain the EyePop inference data from the video
+        #  0. Obtain the EyePop inference data from the video. Results are streamed from EyePop as they are
+        #     inferred and cached per video, so only the part of a video that is not cached yet is inferred
         #
-        if analyze:
+        if analyze and save:
             print("Analyzing video")
-            em.get_inference_data(video_path)
+            results = em.cached_inference(video_path, cache_dir=cache_dir, shards=shards, endpoints=endpoints,
+                                          analysis_fps=analysis_fps)
+        elif analyze and shards > 1:
+            print("Analyzing video")
+            results = em.sharded_inference(video_path, shards=shards, endpoints=endpoints, analysis_fps=analysis_fps)
+        elif analyze:
+            print("Analyzing video")
+            results = em.prefetch(em.stream_inference(video_path, analysis_fps=analysis_fps))
+        elif results_path:
+            results = em.read_results(results_path)
+        else:
+            results = em.read_cached_results(video_path, cache_dir=cache_dir, analysis_fps=analysis_fps)
 
         # The PersonTracker class is used to track people in the video
-        person_tracker = pt.PersonTracker(smoothing=smoothing)
-
-        time.sleep(1)
-
-        # read the data.json files which contains the results of the eyepop inference
-        json_data = open("data.json", "r")
-        json_data = json.load(json_data)
+        person_tracker = pt.PersonTracker(smoothing=smoothing, trace_conflict=trace_conflict, ocr_every=ocr_every)
 
         #
         #  1. iterate through the eyepop results and add the people to the person tracker
         #
         source_width = 0
         source_height = 0
-        for result in json_data:
-
-            source_width = result['source_width']
-            source_height = result['source_height']
+        ball_track = bt.BallTrack()
+        for columns in rc.iter_columns(results):
 
-            sports_ball_location = {
-                'x': -1, 'y': -1, 'width': -1, 'height': -1
-            }
+            source_width = columns.source_width
+            source_height = columns.source_height
 
-            # skip any empty results
-            if 'objects' not in result:
-                continue
+            ball_track.add(columns)
+            rc.add_to_tracker(person_tracker, columns)
 
-            # iterate through the people in the video
-            for obj in result['objects']:
-
-                if obj['classLabel'] != 'person':
-                    continue
-
-                # Out primary data points for the players
-                ball_distance = -1
-                labels = []
-                trace_id = None
-
-                # grab the labels from the person if it exists
-                if 'objects' in obj:
-                    for child in obj['objects']:
-                        if child['classLabel'] == 'text' and 'labels' in child and len(child['labels']) > 0:
-                            # flattens the labels objects into a list of strings from child['labels'][i]['label]
-                            child_labels = [label['label']
-                                            for label in child['labels']]
-                            labels.extend(child_labels)
-
-                # grab the trace id from the person if it exists
-                if 'traceId' in obj:
-                    trace_id = obj['traceId']
-
-                # expand the bounds of the person to contain the sports ball location
-                if sports_ball_location['x'] != -1:
-
-                    # Calculate new bounding box coordinates and dimensions
-                    new_min_x = min(obj['x'], sports_ball_location['x'])
-                    new_max_x = max(obj['x'] + obj['width'],
-                                    sports_ball_location['x'] + sports_ball_location['width'])
-                    new_min_y = min(obj['y'], sports_ball_location['y'])
-                    new_max_y = max(obj['y'] + obj['height'],
-                                    sports_ball_location['y'] + sports_ball_location['height'])
-
-                    obj['x'] = new_min_x
-                    obj['y'] = new_min_y
-                    obj['width'] = new_max_x - new_min_x
-                    obj['height'] = new_max_y - new_min_y
-
-                # Calculate the normalized distance between the person and the ball
-                if sports_ball_location['x'] != -1:
-                    # Calculate normalized center coordinates of the sports ball
-                    x1 = (sports_ball_location['x'] +
-                          (sports_ball_location['width'] / 2)) / source_width
-                    y1 = (sports_ball_location['y'] +
-                          (sports_ball_location['height'] / 2)) / source_height
-
-                    # Calculate normalized center coordinates of the object (person)
-                    x2 = (obj['x'] + (obj['width'] / 2)) / source_width
-                    y2 = (obj['y'] + (obj['height'] / 2)) / source_height
-
-                    # Euclidean distance between the two normalized points
-                    ball_distance = ((x1 - x2)**2 + (y1 - y2)**2)**0.5
-
-                # if there is no trace id, we ignore the person
-                if (trace_id == None and labels == []):
-                    continue
-
-                # add the person to the person tracker
-                person_tracker.add_person(
-                    labels=labels,
-                    trace_id=trace_id,
-                    frame_time=result['seconds'],
-                    bounds=[obj['x'], obj['y'],
-                            obj['width'], obj['height']]
-                )
+        # find the player closest to the ball in every frame, and grow their bounds to contain the ball
+        bt.assign_possession(person_tracker, ball_track, source_width, source_height)
 
         # filter and consolidate the people in the person tracker
-        person_tracker.filter_map(source_width, source_height, threshold=2)
+        person_tracker.filter_map(source_width, source_height, threshold=2, segments=segments,
+                                  max_duration=max_duration)
+
+        # players seen for less than about a second are ignored, 30 frames at the usual frame rate
+        min_detections = max(1, round(analysis_fps)) if analysis_fps else 30
 
         if (debug):
+            print('Trace ids reassigned between players:', person_tracker.reassignments)
+            if ocr_every > 1 or trace_conflict == 'vote':
+                print('Labels skipped on confirmed traces:', person_tracker.skipped_reads)
+            if trace_conflict == 'vote':
+                print('Traces locked to a jersey:', len(person_tracker.trace_locked),
+                      ' traces dropped without a quorum:', len(person_tracker.pending))
+            for label, jersey in person_tracker.merged.items():
+                print('Merged jersey', label, 'into', jersey)
+
             # print all the keys in the person tracker
             for key in person_tracker.people.keys():
-                if len(person_tracker.people[key]['seconds']) > 30:
+                if len(person_tracker.people[key]) > min_detections:
                     print('Player found:', key,  ' frames detected: ',
-                          len(person_tracker.people[key]['seconds']))
+                          len(person_tracker.people[key]), ' frames with the ball: ',
+                          int(person_tracker.people[key].has_ball.sum()))
             return
 
         #
-        #   2. create the output videos
+        #   2. create the output videos, every player is rendered from a single decode of the video
         #
+        clips = {}
         for key in person_tracker.people.keys():
             person = person_tracker.people[key]
 
             if target_jersey_number and target_jersey_number != key:
                 continue
 
-            # if the player has less than 30 frames of video, we ignore them
-            if len(person['seconds']) < 30:
+            # if the player has less than a second of video, we ignore them
+            if len(person) < min_detections:
+                continue
+
+            # or if they have no highlights at all
+            if not person.time_segments:
+                print('Skipping player', key, 'without highlights')
                 continue
 
             file_name = 'player_' + key + '.mp4'
 
-            print(video_file_path, file_name, person['time_segments'])
+            print(video_file_path, file_name, person.time_segments)
 
-            time.sleep(1)
+            clips[file_name] = (person.time_segments, person.timeline())
 
-            mm.create_video(video_file_path, file_name,
-                            person['time_segments'], person['bounds'], resolution=(720, 600), draw_bounds=draw_bounds)
+        mm.create_videos(video_file_path, clips,
+                         resolution=(720, 600), draw_bounds=draw_bounds, headless=headless, workers=workers,
+                         background=background)
 
     upload_video(video_file_path)
 
@@ -162,9 +120,26 @@ args.add_argument("--analyze", action="store_true")
 args.add_argument("--smoothing", type=float, default=.95, nargs='?')
 args.add_argument("--draw_bounds", action="store_true")
 args.add_argument("--debug", action="store_true")
+args.add_argument("--headless", action="store_true")
+args.add_argument("--workers", type=int, default=os.cpu_count(), nargs='?')
+args.add_argument("--background", type=str, default='fast', choices=['fast', 'full'])
+args.add_argument("--trace_conflict", type=str, default='vote', choices=['first', 'recent', 'majority', 'vote'])
+args.add_argument("--results", type=str, default=None, nargs='?')
+args.add_argument("--no_save", action="store_true")
+args.add_argument("--cache", type=str, default='cache', nargs='?')
+args.add_argument("--segments", type=str, default='possession', choices=['possession', 'presence'])
+args.add_argument("--max_duration", type=float, default=60.0, nargs='?')
+args.add_argument("--shards", type=int, default=1, nargs='?')
+args.add_argument("--endpoints", type=int, default=None, nargs='?')
+args.add_argument("--analysis_fps", type=float, default=None, nargs='?')
+args.add_argument("--ocr_every", type=int, default=1, nargs='?')
 args = args.parse_args()
 
 print(args)
 
 main(args.video, args.target, analyze=args.analyze,
-     smoothing=args.smoothing, draw_bounds=args.draw_bounds, debug=args.debug)
+     smoothing=args.smoothing, draw_bounds=args.draw_bounds, debug=args.debug,
+     headless=args.headless, workers=args.workers, background=args.background,
+     trace_conflict=args.trace_conflict, results_path=args.results, save=not args.no_save,
+     cache_dir=args.cache, segments=args.segments, max_duration=args.max_duration,
+     shards=args.shards, endpoints=args.endpoints, analysis_fps=args.analysis_fps, ocr_every=args.ocr_every)
@@ -1,23 +1,342 @@
-from moviepy.editor import VideoFileClip, concatenate_videoclips, CompositeVideoClip, ColorClip, transfx
-from moviepy.video.VideoClip import VideoClip
 import os
+import queue
+import shutil
 import subprocess
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import cv2
-import subprocess
 
 import twod
+from timeline import BoundsTimeline
+
+SPRITE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "indicator.png")
+
+
+class SpriteCache:
+    """
+    The indicator sprite resized to every size it is drawn at, stored premultiplied so drawing it is one
+    saturating multiply and add. The sprite is loaded on first use, and one cache is shared by every clip
+    and compose thread of a render. The sprite sizes are bounded by `layout_rects`, so the cache stays small.
+    """
+
+    def __init__(self, path=SPRITE_PATH):
+        self.path = path
+        self.sprite = None
+        self.sizes = {}
+        self.lock = threading.Lock()
+
+    def get(self, width, height):
+        """ Returns the (foreground * alpha, 255 - alpha) uint8 pair of the sprite at `width` x `height`. """
+        overlay = self.sizes.get((width, height))
+        if overlay is not None:
+            return overlay
+
+        with self.lock:
+            if self.sprite is None:
+                self.sprite = cv2.imread(self.path, cv2.IMREAD_UNCHANGED)
+                if self.sprite is None:
+                    raise FileNotFoundError(self.path)
+
+            resized = cv2.resize(self.sprite, (width, height))
+            alpha = cv2.merge([resized[:, :, 3]] * 3)
+            foreground = cv2.multiply(resized[:, :, :3], alpha, scale=1 / 255)
+            overlay = self.sizes[(width, height)] = (foreground, 255 - alpha)
+
+        return overlay
+
+
+sprites = SpriteCache()
+
+
+def blend_overlay(background, overlay):
+    """ Draws a premultiplied (foreground, inverse alpha) overlay onto the uint8 `background` in place. """
+    foreground, inverse_alpha = overlay
+    cv2.multiply(background, inverse_alpha, dst=background, scale=1 / 255)
+    cv2.add(background, foreground, dst=background)
+
+
+def get_frame_schedule(segments, frame_rate):
+    """
+    Returns the (frame_index, time) pairs needed to render `segments`, sorted by frame index
+    so the source video can be decoded front to back exactly once.
+    """
+    schedule = []
+    for start, end in segments:
+        for t in np.arange(start, end, 1.0 / frame_rate):
+            schedule.append((int(t * frame_rate), t))
+
+    schedule.sort(key=lambda item: item[0])
+    return schedule
+
+
+def read_frames(cap, frame_indices, max_skip=None):
+    """
+    Decodes the given sorted frame indices in a single forward pass and yields (frame_index, frame).
+
+    The capture only seeks when the next wanted frame is more than `max_skip` frames ahead, ie. at
+    segment boundaries. Smaller gaps are decoded with `cap.grab()` and dropped, which is cheaper than
+    a seek since every seek has to decode again from the previous keyframe.
+    """
+    if max_skip is None:
+        max_skip = int(2 * cap.get(cv2.CAP_PROP_FPS))
+
+    position = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+    frame = None
+    frame_index = None
+
+    for index in frame_indices:
+
+        # the same frame may be requested more than once, reuse the last decoded frame
+        if index == frame_index:
+            yield index, frame
+            continue
+
+        if index < position or index - position > max_skip:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+            position = index
+
+        while position < index:
+            if not cap.grab():
+                print("Error reading frame: " + str(position))
+                return
+            position += 1
+
+        ret, frame = cap.read()
+        if not ret:
+            print("Error reading frame: " + str(index))
+            return
+
+        position += 1
+        frame_index = index
+        yield index, frame
+
+
+def read_frames_seeking(cap, frame_indices):
+    """ Seeks before every frame, this is the original decode strategy and is kept for benchmarking. """
+    for index in frame_indices:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+        ret, frame = cap.read()
+
+        if not ret:
+            print("Error reading frame: " + str(index))
+            return
+
+        yield index, frame
+
+
+def blur_background(frame, blur_rect, output_rect, background='fast', kernel_size=51, downscale=8):
+    """
+    Returns the blurred letterbox background of `output_rect` size, taken from `blur_rect` of the frame.
+
+    'full' box blurs the whole frame with `kernel_size` before cropping. 'fast' crops first, shrinks the
+    crop by `downscale`, blurs it with a kernel shrunk by the same factor and scales it back up, which
+    looks the same for a background this blurry at a small fraction of the cost.
+    """
+    if background == 'full':
+        blurred_frame = cv2.blur(frame, (kernel_size, kernel_size))
+        return cv2.resize(blurred_frame[twod.to_slice(
+            blur_rect)], (output_rect.w, output_rect.h))
+
+    small_size = (max(1, blur_rect.w // downscale), max(1, blur_rect.h // downscale))
+    small_kernel_size = max(1, round(kernel_size / downscale))
+
+    small = cv2.resize(frame[twod.to_slice(blur_rect)], small_size, interpolation=cv2.INTER_LINEAR)
+    small = cv2.blur(small, (small_kernel_size, small_kernel_size))
+    return cv2.resize(small, (output_rect.w, output_rect.h), interpolation=cv2.INTER_LINEAR)
+
 
-sprite = cv2.imread("indicator.png", cv2.IMREAD_UNCHANGED)
+def layout_rects(bounds, frame_rect, roi_padding=200, roi_min_size=500, sprite_min_size=20, sprite_max_size=50):
+    """
+    Computes the rects compose_frame needs for every row of [x, y, w, h] `bounds` at once.
 
+    Returns:
+        (array, array, array): The bounds, roi and sprite rect arrays, see twod.get_rects.
+    """
+    bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)
+    bounds_rects = twod.get_rects(x=bounds[:, 0], y=bounds[:, 1], w=bounds[:, 2], h=bounds[:, 3])
+    x, y, w, h = bounds_rects.T
+    center_x = x + w // 2
+    center_y = y + h // 2
 
-def get_bounds_at_time(time_bounds, t):
-    """ Interpolate or retrieve bounds at given time `t`. """
-    closest_time = min(time_bounds.keys(), key=lambda x: abs(x - t))
-    return time_bounds[closest_time]
+    # calculate the size of the region of interest, keeping it a square
+    desired_roi_size = np.maximum(w, h) + 2 * roi_padding
+    roi_size = np.minimum(np.maximum(roi_min_size, desired_roi_size), frame_rect.min_dim)
+    roi_rects = twod.get_rects_clamped_inside_another_rect(
+        center_x=center_x, center_y=center_y, w=roi_size, h=roi_size, outer_rects=frame_rect)
 
+    # calculate the size of the sprite, scaled with the width of the bounds
+    sprite_size = np.minimum(np.maximum(sprite_min_size, np.trunc(bounds[:, 2] * 0.3).astype(np.int64)), sprite_max_size)
+    sprite_rects = twod.get_rects_clamped_inside_another_rect(
+        center_x=center_x, center_y=y - sprite_size / 2, w=sprite_size, h=sprite_size, outer_rects=roi_rects)
+
+    return bounds_rects, roi_rects, sprite_rects
+
+
+def compose_frame(frame, layout, output_rect, dst_rect, blur_rect, draw_bounds=False, background='fast', sprite_cache=sprites):
+    """
+    Crops the frame around the player and composes it over a blurred background.
+
+    Args:
+        layout (tuple): The (bounds, roi, sprite) Rects of this frame, see `layout_rects`.
+        blur_rect (Rect): The part of the frame blurred for the background.
+        sprite_cache (SpriteCache): The resized indicator sprites.
+    """
+    bounds_rect, roi_rect, sprite_rect = layout
+
+    # the same decoded frame is shared by every clip that uses it, so draw on a copy
+    frame = frame.copy()
+
+    if draw_bounds:
+        cv2.rectangle(frame, *twod.to_corners(bounds_rect), (0, 255, 0), 2)
+
+    # Add the sprite to the cropped frame, respecting alpha channel
+    blend_overlay(frame[twod.to_slice(sprite_rect)], sprite_cache.get(sprite_rect.w, sprite_rect.h))
+    roi = frame[twod.to_slice(roi_rect)]
+
+    # fill in the rest of the frame with a blurred version of the frame
+    output = blur_background(frame, blur_rect, output_rect, background=background)
+
+    roi_resized = cv2.resize(roi, (dst_rect.w, dst_rect.h))
+    output[twod.to_slice(dst_rect)] = roi_resized
 
-def create_video(video_path, output_video_path, segments, bounds, resolution=(720, 720), draw_bounds=False):
+    if draw_bounds:
+        # uncomment to show roi within frame. red is roi, green is bounds
+        cv2.rectangle(frame, *twod.to_corners(roi_rect),
+                      (0, 0, 255), 2)
+        output = frame
+
+    return output
+
+
+class StreamingSink:
+    """
+    Base class for the encoder sinks, frames are handed to a writer thread through a bounded queue
+    so encoding overlaps decoding and composing without buffering the whole clip in memory.
+    """
+
+    def __init__(self, resolution, max_queued_frames=32):
+        self.resolution = resolution
+        self.error = None
+        self.queue = queue.Queue(maxsize=max_queued_frames)
+        self.thread = threading.Thread(target=self._pump, daemon=True)
+        self.thread.start()
+
+    def write(self, frame):
+        if self.error is not None:
+            raise self.error
+
+        # every frame of a clip has to be the same size, draw_bounds outputs the full source frame
+        if frame.shape[1] != self.resolution[0] or frame.shape[0] != self.resolution[1]:
+            frame = cv2.resize(frame, self.resolution)
+
+        self.queue.put(frame)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self._finish()
+
+        if self.error is not None:
+            raise self.error
+
+    def _pump(self):
+        while (frame := self.queue.get()) is not None:
+            if self.error is not None:
+                continue
+            try:
+                self._write_frame(frame)
+            except Exception as e:
+                self.error = e
+
+    def _write_frame(self, frame):
+        raise NotImplementedError
+
+    def _finish(self):
+        raise NotImplementedError
+
+
+class FFmpegSink(StreamingSink):
+    """ Pipes raw BGR frames into the stdin of an ffmpeg process which encodes them with libx264. """
+
+    def __init__(self, output_path, resolution, fps, max_queued_frames=32):
+        ffmpeg_cmd = [
+            "ffmpeg",
+            "-loglevel", "error",
+            "-f", "rawvideo",
+            "-pix_fmt", "bgr24",
+            "-s", f"{resolution[0]}x{resolution[1]}",
+            "-r", str(fps),
+            "-i", "-",
+            "-c:v", "libx264",
+            "-pix_fmt", "yuv420p",
+            output_path,
+            '-y'
+        ]
+
+        print(' '.join(ffmpeg_cmd))
+
+        self.ffmpeg_cmd = ffmpeg_cmd
+        self.process = subprocess.Popen(ffmpeg_cmd, stdin=subprocess.PIPE)
+        super().__init__(resolution, max_queued_frames)
+
+    def _write_frame(self, frame):
+        self.process.stdin.write(np.ascontiguousarray(frame).data)
+
+    def _finish(self):
+        self.process.stdin.close()
+        if self.process.wait() != 0 and self.error is None:
+            self.error = subprocess.CalledProcessError(self.process.returncode, self.ffmpeg_cmd)
+
+
+class VideoWriterSink(StreamingSink):
+    """ Encodes the frames with cv2.VideoWriter, for machines without ffmpeg on the PATH. """
+
+    def __init__(self, output_path, resolution, fps, max_queued_frames=32):
+        self.writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, resolution)
+        super().__init__(resolution, max_queued_frames)
+
+    def _write_frame(self, frame):
+        self.writer.write(frame)
+
+    def _finish(self):
+        self.writer.release()
+
+
+def open_sink(output_path, resolution, fps, encoder='ffmpeg'):
+    """ Returns the sink for `encoder`, falling back to OpenCV when ffmpeg is not installed. """
+    if encoder == 'ffmpeg' and shutil.which('ffmpeg') is not None:
+        return FFmpegSink(output_path, resolution, fps)
+
+    return VideoWriterSink(output_path, resolution, fps)
+
+
+def create_video(video_path, output_video_path, segments, bounds, resolution=(720, 720), draw_bounds=False, seek_every_frame=False, encoder='ffmpeg', headless=False, workers=1, background='fast', interpolate_bounds=True):
+    """ Renders a single clip, see `create_videos`. """
+    create_videos(video_path, {output_video_path: (segments, bounds)},
+                  resolution=resolution, draw_bounds=draw_bounds, seek_every_frame=seek_every_frame, encoder=encoder,
+                  headless=headless, workers=workers, background=background, interpolate_bounds=interpolate_bounds)
+
+
+def create_videos(video_path, clips, resolution=(720, 720), draw_bounds=False, seek_every_frame=False, encoder='ffmpeg', headless=False, workers=1, background='fast', interpolate_bounds=True):
+    """
+    Renders several clips from one decode of `video_path`.
+
+    Args:
+        video_path (str): The source video.
+        clips (dict): Maps each output video name to its (segments, bounds), eg. one entry per player.
+            The bounds are a BoundsTimeline or a {frame_time: [x, y, w, h]} dict.
+        resolution (tuple): The output resolution of every clip.
+        draw_bounds (bool): Draw the tracked bounds and roi instead of the composed clip.
+        seek_every_frame (bool): Use the original seek-per-frame decoding, only useful for benchmarking.
+        encoder (str): 'ffmpeg' to pipe frames into an ffmpeg process or 'opencv' for cv2.VideoWriter.
+        headless (bool): Don't preview the frames with cv2.imshow, required on machines without a display.
+        workers (int): The number of threads composing frames. OpenCV releases the GIL, so this scales
+            with the cores available. Frames are still written to each clip in order.
+        background (str): 'fast' or 'full', how the letterbox background is blurred, see `blur_background`.
+        interpolate_bounds (bool): Interpolate the bounds between detections instead of using the nearest one.
+    """
 
     video_file_name = os.path.basename(video_path)
     video_file_name = ''.join(e for e in video_file_name if e.isalnum())
@@ -25,135 +344,104 @@ def create_video(video_path, output_video_path, segments, bounds, resolution=(72
     cap = cv2.VideoCapture(video_path)
     frame_rate = cap.get(cv2.CAP_PROP_FPS)
 
-    output_folder = 'output\\' + output_video_path + '_temp\\'
+    frame_rect = twod.get_rect(
+        x=0, y=0, w=cap.get(cv2.CAP_PROP_FRAME_WIDTH), h=cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    output_rect = twod.get_rect(x=0, y=0, w=resolution[0], h=resolution[1])
+    blur_rect = twod.get_rect_fit_inside_another_rect(
+        inner_rect=output_rect, outer_rect=frame_rect)
 
-    print(video_file_name, video_path, output_video_path, output_folder)
+    dst_padding = 10
+    dst_size = output_rect.min_dim - 2 * dst_padding
+    dst_rect = twod.get_rect(
+        center_x=output_rect.center_x, center_y=output_rect.center_y, w=dst_size, h=dst_size)
 
-    # Create output folder if it doesn't exist
-    os.makedirs(output_folder, exist_ok=True)
+    os.makedirs('output', exist_ok=True)
 
-    dst = False
-    count = 0
+    # merge every clip's frames into one schedule, so each source frame is decoded only once
+    sinks = {}
+    try:
+        schedule = []
+        for output_video_path, (segments, bounds) in clips.items():
+            output_path = os.path.join('output', f"{video_file_name}_{output_video_path}.mp4")
 
-    output_rect = twod.get_rect(x=0, y=0, w=resolution[0], h=resolution[1])
+            print(video_file_name, video_path, output_video_path, output_path)
 
-    dst_padding = 10
-    dst_size = output_rect['min_dim'] - 2 * dst_padding
-    dst_rect = twod.get_rect(
-        center_x=output_rect['center_x'], center_y=output_rect['center_y'], w=dst_size, h=dst_size)
+            sinks[output_video_path] = open_sink(output_path, resolution, frame_rate, encoder=encoder)
 
-    for i, (start, end) in enumerate(segments):
+            if not isinstance(bounds, BoundsTimeline):
+                bounds = BoundsTimeline.from_dict(bounds)
 
-        for t in np.arange(start, end, 1.0 / frame_rate):
-            cap.set(cv2.CAP_PROP_POS_FRAMES, int(t * frame_rate))
-            ret, frame = cap.read()
-            output = None
-
-            if not ret:
-                print("Error reading frame: " + str(t))
-                break
-
-            frame_rect = twod.get_rect(
-                x=0, y=0, w=frame.shape[1], h=frame.shape[0])
-            blur_rect = twod.get_rect_fit_inside_another_rect(
-                inner_rect=output_rect, outer_rect=frame_rect)
-
-            bounds_at_time = get_bounds_at_time(bounds, t)
-            x1, y1, w, h = bounds_at_time[0], bounds_at_time[1], bounds_at_time[2], bounds_at_time[3]
-            bounds_rect = twod.get_rect(x=x1, y=y1, w=w, h=h)
-
-            count += 1
-
-            if draw_bounds:
-                cv2.rectangle(frame, (bounds_rect['left'], bounds_rect['top']),
-                              (bounds_rect['right'], bounds_rect['bottom']), (0, 255, 0), 2)
-
-            # calculate the size of the region of interest, keeping it a square
-            roi_padding = 200  # w // 2
-            desired_roi_size = int(bounds_rect['max_dim'] + 2 * roi_padding)
-            roi_size = min(max(500, desired_roi_size), frame_rect['min_dim'])
-            roi_rect = twod.get_rect_clamped_inside_another_rect(
-                center_x=bounds_rect['center_x'], center_y=bounds_rect['center_y'], w=roi_size, h=roi_size, outer_rect=frame_rect)
-
-            # calculate the size of the sprite
-            sprite_min_size = 20
-            sprite_max_size = 50
-            # Adjust the scale factor as needed
-            sprite_width = min(
-                max(sprite_min_size, int(w * 0.3)), sprite_max_size)
-            sprite_height = int(sprite_width)
-            sprite_resized = cv2.resize(sprite, (sprite_width, sprite_height))
-            sprite_rect = twod.get_rect_clamped_inside_another_rect(
-                center_x=bounds_rect['center_x'], center_y=bounds_rect['top']-sprite_height/2, w=sprite_width, h=sprite_height, outer_rect=roi_rect)
-
-            # Add the sprite to the cropped frame, respecting alpha channel
-            alpha = sprite_resized[:, :, 3] / 255.0
-            foreground = sprite_resized[:, :, :3]
-            background = frame[twod.to_slice(sprite_rect)]
-
-            # Expand the dimensions of alpha to match the shape of foreground and background
-            alpha_expanded = np.expand_dims(alpha, axis=2)
-
-            # Multiply alpha_expanded with foreground and (1 - alpha_expanded) with background
-            blended = (alpha_expanded * foreground +
-                       (1 - alpha_expanded) * background).astype(np.uint8)
-
-            frame[twod.to_slice(sprite_rect)] = blended
-            roi = frame[twod.to_slice(roi_rect)]
-
-            # fill in the rest of the frame with a blurred version of the frame
-            blurred_frame = cv2.blur(frame, (51, 51))
-            blurred_frame = cv2.resize(
-                blurred_frame, [frame.shape[1], frame.shape[0]])
-
-            output = cv2.resize(blurred_frame[twod.to_slice(
-                blur_rect)], (output_rect['w'], output_rect['h']))
-
-            roi_resized = cv2.resize(roi, (dst_rect['w'], dst_rect['h']))
-            output[twod.to_slice(dst_rect)] = roi_resized
-
-            if draw_bounds:
-                # uncomment to show roi within frame. red is roi, green is bounds
-                cv2.rectangle(frame, *twod.to_corners(roi_rect),
-                              (0, 0, 255), 2)
-                output = frame
-
-            print(f"Writing frame {
-                  t} to " + os.path.join(output_folder, str(count).zfill(4) + ".jpg"))
-
-            cv2.imwrite(os.path.join(output_folder, str(
-                count).zfill(4) + ".jpg"), output)
+            # look up the bounds of every frame of the clip in one batched query
+            clip_schedule = get_frame_schedule(segments, frame_rate)
+            clip_bounds = bounds.at_times([t for _, t in clip_schedule], interpolate=interpolate_bounds)
 
-            cv2.imshow('frame' + output_video_path, output)
+            # and lay out the rects of every frame of the clip in one batch too
+            layouts = zip(*[twod.to_rects(rects) for rects in layout_rects(clip_bounds, frame_rect)])
 
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                exit()
-                break
-        cv2.destroyAllWindows()
+            for (index, t), layout in zip(clip_schedule, layouts):
+                schedule.append((index, t, output_video_path, layout))
 
-    cap.release()
+        schedule.sort(key=lambda item: item[0])
 
-    combine_images_to_video(
-        output_folder, f"output\\{video_file_name}_{output_video_path}.mp4", resolution=resolution, fps=frame_rate)
+        frame_indices = [index for index, _, _, _ in schedule]
+        frames = read_frames_seeking(cap, frame_indices) if seek_every_frame else read_frames(cap, frame_indices)
 
+        def write_output(t, output_video_path, output):
+            print(f"Writing frame {t} to {output_video_path}")
 
-def combine_images_to_video(image_folder, output_path, resolution, fps):
-    current_path = os.path.dirname(os.path.abspath(__file__))
-    ffmpeg_cmd = [
-        "ffmpeg",
-        "-r", str(int(fps)),
-        "-i", os.path.join(current_path, image_folder, "%04d.jpg"),
-        "-c:v", "libx264",
-        "-vf", f"fps={int(fps)}",
-        "-pix_fmt", "yuv420p",
-        os.path.join(current_path, output_path),
-        '-y'
-    ]
+            sinks[output_video_path].write(output)
 
-    print('\n\n\n\n\n\n\n\n', ' '.join(ffmpeg_cmd), '\n\n\n\n\n\n\n\n')
+            if headless:
+                return
 
-    subprocess.run(ffmpeg_cmd, check=True)
+            cv2.imshow('frame' + output_video_path, output)
+
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                exit()
 
-    # Delete the image folder
-    subprocess.run(["cmd", "/c", "rmdir", "/s", "/q",
-                   os.path.join(current_path, image_folder)])
+        # fan each decoded frame out to the clips that need it, composing up to `workers` frames at once.
+        #   the futures are consumed in schedule order, which keeps every clip's frames in order
+        max_pending = 2 * max(1, workers)
+        pending = deque()
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+
+            for (_, t, output_video_path, layout), (_, frame) in zip(schedule, frames):
+
+                pending.append((t, output_video_path, pool.submit(
+                    compose_frame, frame, layout, output_rect, dst_rect, blur_rect, draw_bounds, background)))
+
+                while len(pending) >= max_pending or (pending and pending[0][2].done()):
+                    t, output_video_path, future = pending.popleft()
+                    write_output(t, output_video_path, future.result())
+
+            while pending:
+                t, output_video_path, future = pending.popleft()
+                write_output(t, output_video_path, future.result())
+
+    except BaseException:
+        # close every sink even when a frame failed, so no ffmpeg process or writer thread is left running and
+        #   the partial clips are finalized with an index, then raise the error of the frame
+        for sink in sinks.values():
+            try:
+                sink.close()
+            except Exception:
+                pass
+        raise
+
+    finally:
+        if not headless:
+            cv2.destroyAllWindows()
+
+        cap.release()
+
+    # close every sink even when one of them fails to finalize, then raise the first error
+    error = None
+    for sink in sinks.values():
+        try:
+            sink.close()
+        except Exception as e:
+            if error is None:
+                error = e
+    if error is not None:
+        raise error
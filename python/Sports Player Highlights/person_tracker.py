@@ -1,197 +1,556 @@
 import numpy as np
 import scipy.signal
-
-# A PersonTracker class which has a map of people, where the key is a traceID and the values are the person's jersey number and the number of frames the person has been in the video.
+from numpy.lib.stride_tricks import sliding_window_view
+
+import segment_builder
+from timeline import BoundsTimeline
+
+# A PersonTracker class which has a map of people, where the key is the person's jersey number and the value is a Track of
+# every frame the person has been detected in.
+
+
+class Track:
+    """
+    Columnar storage of one person's detections. Times, trace ids and each of x/y/w/h are kept in their own contiguous
+    array, which grows by doubling so appending stays O(1) amortized.
+    """
+
+    def __init__(self, capacity=256):
+        self._times = np.empty(capacity, dtype=np.float64)
+        self._ids = np.empty(capacity, dtype=np.int64)
+        self._boxes = np.empty((4, capacity), dtype=np.float64)
+        self.size = 0
+        self.time_segments = []
+
+        # per detection, set by ball_tracker.assign_possession: the normalized distance to the ball (-1 without a
+        #   ball) and whether this player was the closest to it
+        self.ball_distance = None
+        self.has_ball = None
+
+    def __len__(self):
+        return self.size
+
+    def append(self, frame_time: float, trace_id: int, bounds: []) -> None:
+        if self.size == len(self._times):
+            self._grow()
+
+        self._times[self.size] = frame_time
+        self._ids[self.size] = -1 if trace_id is None else trace_id
+        self._boxes[:, self.size] = bounds
+        self.size += 1
+
+    def extend(self, other) -> None:
+        # the ball arrays are only kept when both tracks have them, or this one was empty
+        if other.ball_distance is not None and (self.ball_distance is not None or self.size == 0):
+            own_distance = self.ball_distance if self.size else np.empty(0)
+            own_has_ball = self.has_ball if self.size else np.empty(0, dtype=bool)
+            self.set_ball(np.concatenate((own_distance, other.ball_distance)),
+                          np.concatenate((own_has_ball, other.has_ball)))
+        else:
+            self.ball_distance = None
+            self.has_ball = None
+
+        self.extend_arrays(other.seconds, other.ids, other.boxes)
+
+    def extend_arrays(self, seconds, ids, boxes) -> None:
+        """ Appends many detections at once, `ids` uses -1 for detections without a trace id. """
+        count = len(seconds)
+        while self.size + count > len(self._times):
+            self._grow()
+
+        self._times[self.size:self.size + count] = seconds
+        self._ids[self.size:self.size + count] = ids
+        self._boxes[:, self.size:self.size + count] = np.asarray(boxes).T
+        self.size += count
+
+    def _grow(self):
+        capacity = 2 * len(self._times)
+        self._times = np.resize(self._times, capacity)
+        self._ids = np.resize(self._ids, capacity)
+        boxes = np.empty((4, capacity), dtype=np.float64)
+        boxes[:, :self.size] = self._boxes[:, :self.size]
+        self._boxes = boxes
+
+    @property
+    def seconds(self):
+        return self._times[:self.size]
+
+    @property
+    def ids(self):
+        """ The trace id of every detection, -1 when the detection had none. """
+        return self._ids[:self.size]
+
+    @property
+    def boxes(self):
+        """ A (n, 4) view of the [x, y, w, h] of every detection. """
+        return self._boxes[:, :self.size].T
+
+    def set_boxes(self, boxes) -> None:
+        self._boxes[:, :self.size] = np.asarray(boxes).T
+
+    def set_ball(self, ball_distance, has_ball) -> None:
+        self.ball_distance = np.asarray(ball_distance, dtype=np.float64)
+        self.has_ball = np.asarray(has_ball, dtype=bool)
+
+    def sort(self) -> None:
+        """ Orders the detections by time. Detections at the same time keep the order they were added in. """
+        order = np.argsort(self.seconds, kind='stable')
+        self._times[:self.size] = self.seconds[order]
+        self._ids[:self.size] = self.ids[order]
+        self._boxes[:, :self.size] = self._boxes[:, :self.size][:, order]
+
+        if self.ball_distance is not None:
+            self.ball_distance = self.ball_distance[order]
+            self.has_ball = self.has_ball[order]
+
+    def keep(self, index) -> None:
+        """ Keeps only the detections at `index`, in that order. """
+        index = np.asarray(index)
+        count = len(index)
+        self._times[:count] = self.seconds[index]
+        self._ids[:count] = self.ids[index]
+        self._boxes[:, :count] = self._boxes[:, :self.size][:, index]
+        self.size = count
+
+        if self.ball_distance is not None:
+            self.ball_distance = self.ball_distance[index]
+            self.has_ball = self.has_ball[index]
+
+    def deduplicate(self) -> None:
+        """
+        Sorts the detections by time and drops repeated detections of the same trace id in the same frame, left by
+        merging the tracks of two labels read on one person. The first of the repeats is kept.
+        """
+        order = np.lexsort((self.ids, self.seconds))
+        times = self.seconds[order]
+        ids = self.ids[order]
+
+        # detections without a trace id can't be told apart, so they are all kept
+        repeated = np.concatenate(([False], (times[1:] == times[:-1]) & (ids[1:] == ids[:-1]) & (ids[1:] != -1)))
+
+        # keep the survivors in the order they were added, the stable time sort then keeps that order in each frame
+        self.keep(np.sort(order[~repeated]))
+        self.sort()
+
+    def unique_times(self):
+        """
+        Returns the index of the last detection at each distinct time, the detections have to be sorted.
+        When a label is read twice in one frame the last bounds win, like the {frame_time: bounds} map this replaces.
+        """
+        times = self.seconds
+        return np.flatnonzero(np.append(np.diff(times) != 0, True))
+
+    def timeline(self) -> BoundsTimeline:
+        index = self.unique_times()
+        return BoundsTimeline(self.seconds[index], self.boxes[index])
+
+
+def is_jersey_number(label) -> bool:
+    return bool(label) and type(label) == str and label.isnumeric()
 
 
 class PersonTracker:
 
-    def __init__(self, smoothing=20):
+    def __init__(self, smoothing=20, trace_conflict='first', ocr_every=1, ocr_confirm=5, vote_quorum=3.0,
+                 vote_decay=0.9, vote_agreement=0.6):
+        """
+        Args:
+            smoothing (float): The EMA smoothing factor of the bounds, 0 disables smoothing.
+            trace_conflict (str): Which jersey a trace id maps to once it has been read with more than one,
+                'first' keeps the first jersey, 'recent' the latest and 'majority' the most often read.
+                'vote' holds back the detections of a trace id until its reads agree on a jersey, see _vote.
+            ocr_every (int): Once a trace id has been read as its jersey number `ocr_confirm` times in a row, only
+                the labels of every `ocr_every`th detection of the trace are used, the other detections follow
+                the trace id. 1 uses every label.
+            ocr_confirm (int): The reads in a row that confirm the jersey number of a trace id.
+            vote_quorum (float): The summed confidence of the reads that locks the jersey of a trace id.
+            vote_decay (float): Every read of a trace id scales its earlier votes by this factor.
+            vote_agreement (float): The share of the votes the leading jersey needs to lock.
+        """
+        if trace_conflict not in ('first', 'recent', 'majority', 'vote'):
+            raise ValueError('Unknown trace_conflict: ' + str(trace_conflict))
+
         self.people = {}
         self.smoothing = smoothing
+        self.trace_conflict = trace_conflict
+        self.ocr_every = ocr_every
+        self.ocr_confirm = ocr_confirm
+        self.vote_quorum = vote_quorum
+        self.vote_decay = vote_decay
+        self.vote_agreement = vote_agreement
+
+        # trace id -> jersey number, used to place detections without a readable jersey
+        self.trace_index = {}
+        # trace id -> {jersey number: times read}, used by the 'majority' policy and consolidate_people
+        self.trace_reads = {}
+        # trace id -> {jersey number: decayed confidence of its reads}, kept by the 'vote' policy until the trace id
+        #   is locked
+        self.trace_votes = {}
+        # the trace ids whose jersey the 'vote' policy locked, and the held back detections of the others
+        self.trace_locked = set()
+        self.pending = {}
+        # how often a trace id moved from one jersey number to another
+        self.reassignments = 0
+        # jersey number -> the jersey number it was merged into by consolidate_people
+        self.merged = {}
+        # trace id -> reads in a row of its jersey number, and labelled detections skipped since the last read
+        self.trace_streak = {}
+        self.trace_skipped = {}
+        # labelled detections whose labels were skipped, see ocr_every
+        self.skipped_reads = 0
 
     # add a person to the people map
-    def add_person(self, labels: [], trace_id: int, frame_time: float, bounds: []) -> None:
+    def add_person(self, labels: [], trace_id: int, frame_time: float, bounds: [], confidences: [] = None) -> None:
+
+        if self.trace_conflict == 'vote' and trace_id is not None:
+            jersey = self._vote(trace_id, labels, confidences)
+            if jersey is not None:
+                self._track(jersey).append(frame_time, trace_id, bounds)
+            elif trace_id in self.pending:
+                self.pending[trace_id].append(frame_time, trace_id, bounds)
+            return
+
+        # a confirmed trace id only reads its labels every few detections
+        if labels and self._skip_labels(trace_id):
+            labels = []
+
+        # only jersey numbers read in this frame update the trace id index
+        read_labels = len(labels) > 0
 
         # If there are not labels, we try to find the person by trace_id
-        #   This may introduce error if the traceID Jumps from one player to another
-        if len(labels) == 0:
-            for person in self.people:
-                if trace_id in self.people[person]['ids']:
-                    labels.append(person)
-                    break
+        #   This may introduce error if the traceID Jumps from one player to another, see trace_conflict
+        if not read_labels and trace_id in self.trace_index:
+            labels.append(self.trace_index[trace_id])
 
         for label in labels:
 
-            if not label or not type(label) == str or not label.isnumeric():
+            if not is_jersey_number(label):
                 continue
 
             if label not in self.people:
+                self.people[label] = Track()
+
+            self.people[label].append(frame_time, trace_id, bounds)
+
+            if read_labels and trace_id is not None:
+                self._index_trace(trace_id, label)
+
+        if read_labels and trace_id is not None:
+            self._confirm_trace(trace_id, labels)
+
+    def add_people(self, seconds, trace_ids, boxes, labels_by_row, confidences_by_row=None) -> None:
+        """
+        Adds many detections at once, in the same way as calling add_person for each of them in order.
+
+        Args:
+            seconds (array): The frame time of each detection.
+            trace_ids (array): The trace id of each detection, -1 when it has none.
+            boxes (array): (n, 4) the [x, y, w, h] bounds of each detection.
+            labels_by_row (dict): Maps the index of each detection with text labels to the list of its labels.
+            confidences_by_row (dict, optional): The confidence of each of those labels, used by the 'vote' policy.
+        """
+        confidences_by_row = confidences_by_row or {}
+
+        # resolve the jersey numbers of every detection first, this only needs dict lookups
+        rows_by_jersey = {}
+        rows_by_pending_trace = {}
+        for row, trace_id in enumerate(trace_ids.tolist()):
+            trace_id = None if trace_id == -1 else trace_id
+            labels = labels_by_row.get(row)
+
+            if self.trace_conflict == 'vote' and trace_id is not None:
+                jersey = self._vote(trace_id, labels, confidences_by_row.get(row))
+                if jersey is not None:
+                    rows_by_jersey.setdefault(jersey, []).append(row)
+                elif trace_id in self.pending:
+                    rows_by_pending_trace.setdefault(trace_id, []).append(row)
+                continue
 
-                self.people[label] = {
-                    'ids': [trace_id],
-                    'seconds': [],
-                    'time_segments': [],
-                    'bounds': {},
-                }
-
-            self.people[label]['ids'].append(trace_id)
-            self.people[label]['seconds'].append(frame_time)
-            self.people[label]['bounds'][frame_time] = bounds
-
-    def filter_map(self,  width, height, threshold=2):
-        # self.consolidate_people()
-        self.filter_times(threshold)
-        # self.scale_bounds(max_width=width, max_height=height)
-        self.smooth_bounds()
-
-    # combine any people entries with the same jersey number, and remove the duplicates
-    def consolidate_people(self):
-        people = self.people
-
-        for person in people:
-
-            for other_person in people:
-
-                people[person]['seconds'].extend(
-                    people[other_person]['seconds'])
-                people[person]['seconds'].sort()
-
-                people[person]['bounds'].update(
-                    people[other_person]['bounds'])
+            if labels and self._skip_labels(trace_id):
+                labels = None
 
-                people[person]['ids'].extend(
-                    people[other_person]['ids'])
+            if not labels:
+                if trace_id in self.trace_index:
+                    rows_by_jersey.setdefault(self.trace_index[trace_id], []).append(row)
+                continue
 
-                people[other_person]['ids'] = []
+            for label in labels:
+                if not is_jersey_number(label):
+                    continue
+
+                rows_by_jersey.setdefault(label, []).append(row)
+
+                if trace_id is not None:
+                    self._index_trace(trace_id, label)
+
+            if trace_id is not None:
+                self._confirm_trace(trace_id, labels)
+
+        # then append each player's detections as arrays
+        for jersey, rows in rows_by_jersey.items():
+            self._track(jersey).extend_arrays(seconds[rows], trace_ids[rows], boxes[rows])
+
+        # the held back detections of a trace id that was locked later in the batch go to its jersey too
+        for trace_id, rows in rows_by_pending_trace.items():
+            track = self._track(self.trace_index[trace_id]) if trace_id in self.trace_locked else self.pending[trace_id]
+            track.extend_arrays(seconds[rows], trace_ids[rows], boxes[rows])
+
+    def _track(self, jersey: str) -> Track:
+        if jersey not in self.people:
+            self.people[jersey] = Track()
+        return self.people[jersey]
+
+    def _vote(self, trace_id: int, labels: [], confidences: []):
+        """
+        The 'vote' policy. Returns the locked jersey of the trace id, or None while its reads don't agree yet.
+
+        Every jersey number read on the trace adds its OCR confidence to that jersey's votes, after the earlier votes
+        are scaled by vote_decay. Once the leading jersey has vote_quorum votes and vote_agreement of all of them, the
+        trace id is locked to it: its held back detections move to the jersey and its later labels are not read.
+        Trace ids that never lock, eg. a misread referee or a face in the crowd, never become players.
+        """
+        if trace_id in self.trace_locked:
+            if labels:
+                self.skipped_reads += 1
+            return self.trace_index[trace_id]
+
+        if not labels:
+            return None
+
+        confidences = confidences or [1.0] * len(labels)
+        reads = [(label, confidence) for label, confidence in zip(labels, confidences) if is_jersey_number(label)]
+        if not reads:
+            return None
+
+        votes = self.trace_votes.setdefault(trace_id, {})
+        for jersey in votes:
+            votes[jersey] *= self.vote_decay
+        for label, confidence in reads:
+            votes[label] = votes.get(label, 0.0) + confidence
+
+        leader = max(votes, key=votes.get)
+        if votes[leader] < self.vote_quorum or votes[leader] < self.vote_agreement * sum(votes.values()):
+            self.pending.setdefault(trace_id, Track(capacity=16))
+            return None
+
+        self.trace_locked.add(trace_id)
+        self.trace_index[trace_id] = leader
+        del self.trace_votes[trace_id]
+
+        pending = self.pending.pop(trace_id, None)
+        if pending is not None:
+            self._track(leader).extend(pending)
+
+        return leader
+
+    def _skip_labels(self, trace_id: int) -> bool:
+        """ Whether to ignore the labels read on this detection of `trace_id`, see ocr_every. """
+        if self.ocr_every <= 1 or trace_id is None or self.trace_streak.get(trace_id, 0) < self.ocr_confirm:
+            return False
+
+        skipped = self.trace_skipped.get(trace_id, 0) + 1
+        if skipped >= self.ocr_every:
+            self.trace_skipped[trace_id] = 0
+            return False
+
+        self.trace_skipped[trace_id] = skipped
+        self.skipped_reads += 1
+        return True
+
+    def _confirm_trace(self, trace_id: int, labels: []) -> None:
+        """ Counts the reads in a row that agree with the jersey number of the trace id. """
+        if self.ocr_every <= 1:
+            return
 
-        people_to_remove = []
+        if self.trace_index.get(trace_id) in labels:
+            self.trace_streak[trace_id] = self.trace_streak.get(trace_id, 0) + 1
+        else:
+            self.trace_streak[trace_id] = 0
+
+    def _index_trace(self, trace_id: int, label: str) -> None:
+        votes = self.trace_reads.setdefault(trace_id, {})
+        votes[label] = votes.get(label, 0) + 1
+
+        current = self.trace_index.get(trace_id)
+
+        if current is None or self.trace_conflict == 'recent':
+            jersey = label
+        elif self.trace_conflict == 'majority':
+            # the current jersey keeps the trace on a tie
+            jersey = label if votes[label] > votes[current] else current
+        else:
+            jersey = current
+
+        if current is not None and jersey != current:
+            self.reassignments += 1
+
+        self.trace_index[trace_id] = jersey
+
+    def filter_map(self,  width, height, threshold=2, segments='possession', max_duration=60.0, consolidate=True):
+        """
+        Args:
+            width (int): The width of the video.
+            height (int): The height of the video.
+            threshold (float): The longest gap in seconds inside one segment.
+            segments (str): 'possession' scores every second of a player, see segment_builder, while 'presence'
+                keeps every second they are detected in. Players without a tracked ball or a high enough score
+                fall back to 'presence' in 'possession' mode.
+            max_duration (float): The total length in seconds of a player's 'possession' segments.
+            consolidate (bool): Merge the jersey numbers misread on the same person, see consolidate_people.
+        """
+        if segments not in ('possession', 'presence'):
+            raise ValueError('Unknown segments: ' + str(segments))
+
+        if consolidate:
+            self.consolidate_people()
 
-        for person in people:
+        for key in self.people.keys():
+            self.people[key].sort()
 
-            # next we remove duplicate labels
-            people[person]['ids'] = list(set(people[person]['ids']))
-            people[person]['seconds'] = list(
-                set(people[person]['seconds']))
-            people[person]['seconds'].sort()
+        if segments == 'possession':
+            self.score_times(width, height, merge_gap=threshold, max_duration=max_duration)
+        else:
+            self.filter_times(threshold)
+        # self.scale_bounds(max_width=width, max_height=height)
+        self.smooth_bounds()
 
-            # add the person to the removal list if they have no labels
-            if people[person]['ids'] == []:
-                people_to_remove.append(person)
+    # merge the people whose jersey numbers were misread variants of one another, eg. "23" read as "28"
+    def consolidate_people(self, variant_share=0.5):
+        """
+        Merges the tracks of jersey numbers that were misread on another player into that player's track.
+
+        Each trace id is owned by the jersey number read most on it, or detected most on it when its reads were
+        not counted, eg. by the 'vote' policy. Detections that only followed the trace id don't count, so a misread
+        that a trace id kept under the 'first' policy doesn't own it. A number that owns a trace is a real player
+        that is never merged away. Every other number is merged into the owner of the trace holding most of
+        its detections, when at least `variant_share` of them are on that trace. Merges are not chained, so two
+        players sharing a misread number keep their own tracks. Merged tracks are sorted and repeated detections
+        of a trace in the same frame are dropped.
+        """
+        people = self.people
 
-        # remove the people with no labels
-        for person in people_to_remove:
-            del people[person]
+        # trace id -> [(jersey number, detections of the jersey on that trace)]
+        trace_labels = {}
+        for label, track in people.items():
+            trace_ids, trace_counts = np.unique(track.ids, return_counts=True)
+            for trace_id, count in zip(trace_ids.tolist(), trace_counts.tolist()):
+                if trace_id != -1:
+                    trace_labels.setdefault(trace_id, []).append((label, count))
+
+        def owner_of(trace_id, labels):
+            reads = self.trace_reads.get(trace_id, {})
+            if any(reads.get(label, 0) for label, _ in labels):
+                return max(labels, key=lambda label_count: (reads.get(label_count[0], 0), label_count[0]))[0]
+            return max(labels, key=lambda label_count: (label_count[1], label_count[0]))[0]
+
+        trace_owners = {trace_id: owner_of(trace_id, labels) for trace_id, labels in trace_labels.items()}
+        owners = set(trace_owners.values())
+
+        # variant number -> (its detections on the trace, detections of the owner, owner) of its busiest trace
+        busiest = {}
+        for trace_id, labels in trace_labels.items():
+            owner = trace_owners[trace_id]
+            for label, count in labels:
+                if label in owners:
+                    continue
+                candidate = (count, len(people[owner]), owner)
+                if label not in busiest or candidate > busiest[label]:
+                    busiest[label] = candidate
+
+        merged = {label: owner for label, (count, _, owner) in busiest.items()
+                  if count >= variant_share * len(people[label])}
+
+        # move every variant track into the track of its owner
+        for label, owner in merged.items():
+            people[owner].extend(people.pop(label))
+            self.merged[label] = owner
+
+        for owner in set(merged.values()):
+            people[owner].deduplicate()
+
+        # detections without a readable jersey follow the merged number too
+        for trace_id, label in self.trace_index.items():
+            if label in merged:
+                self.trace_index[trace_id] = merged[label]
 
     # scale the bounds up to a minimum size of 500x500 and keep the center of the bounding box the same
     def scale_bounds(self, max_width, max_height):
         for person in self.people:
 
-            for time in self.people[person]['bounds']:
-
-                x, y, w, h = self.people[person]['bounds'][time]
+            x, y, w, h = self.people[person].boxes.T
 
-                # Calculate the center of the bounding box
-                x_center = x + w / 2
-                y_center = y + h / 2
+            # Calculate the center of the bounding box
+            x_center = x + w / 2
+            y_center = y + h / 2
 
-                # Calculate the new width and height
-                new_w = max(max_width//1.5, w)
-                new_h = max(max_width//1.5, h)
+            # Calculate the new width and height
+            new_w = np.maximum(max_width // 1.5, w)
+            new_h = np.maximum(max_width // 1.5, h)
 
-                # Ensure the x+width and y+height are less than the max_width and max_height
-                if x + new_w > max_width:
-                    new_w = max_width - x
-                if y + new_h > max_height:
-                    new_h = max_height - y
+            # Ensure the x+width and y+height are less than the max_width and max_height
+            new_w = np.where(x + new_w > max_width, max_width - x, new_w)
+            new_h = np.where(y + new_h > max_height, max_height - y, new_h)
 
-                # Calculate the new x and y
-                new_x = x_center - new_w / 2
-                new_y = y_center - new_h / 2
+            # Calculate the new x and y
+            new_x = x_center - new_w / 2
+            new_y = y_center - new_h / 2
 
-                self.people[person]['bounds'][time] = [
-                    new_x, new_y, new_w, new_h]
+            self.people[person].set_boxes(np.stack([new_x, new_y, new_w, new_h], axis=1))
 
     # consolidate person time list into segments of times in tuples with a threshold of seconds
     def filter_times(self, threshold=2):
 
         for key in self.people.keys():
 
-            times = self.people[key]['seconds']
-            start_time = times[0]
+            # a new segment starts after every gap longer than the threshold
+            self.people[key].time_segments = segment_builder.presence_segments(self.people[key].seconds, threshold)
 
-            for j in range(1, len(times)):
-                if times[j] - times[j - 1] > threshold:
-                    self.people[key]['time_segments'].append(
-                        (start_time, times[j - 1]))
-                    start_time = times[j]
-
-            # Add the last segment
-            self.people[key]['time_segments'].append((start_time, times[-1]))
+    # keep the best seconds of each person, scored by ball possession, motion and size
+    def score_times(self, width, height, merge_gap=2, max_duration=60.0):
+        for track in self.people.values():
+            track.time_segments = segment_builder.track_segments(
+                track, width, height, merge_gap=merge_gap, max_duration=max_duration)
 
     def average_bounds(self):
         if self.smoothing <= 0:
             return
 
-        same_person_threshold = np.inf
         times_before = 4
         times_after = 4
 
         for key in self.people.keys():
-            bounds = self.people[key]['bounds']
-            seconds = self.people[key]['seconds']
-
-            for s in range(len(seconds)):
-                second = seconds[s]
-
-                times_to_average = seconds[max(
-                    0, s - times_before):min(len(seconds), s + times_after + 1)]
-
-                x_values = []
-                y_values = []
-                w_values = []
-                h_values = []
+            track = self.people[key]
+            index = track.unique_times()
+            boxes = track.boxes[index]
+            count = len(boxes)
 
-                x_start = bounds[second][0]
-                y_start = bounds[second][1]
-                w_start = bounds[second][2]
-                h_start = bounds[second][3]
+            # pad the ends with nan so every detection gets a full window of its neighbours
+            padded = np.full((count + times_before + times_after, 4), np.nan)
+            padded[times_before:times_before + count] = boxes
+            windows = sliding_window_view(padded, times_before + times_after + 1, axis=0)  # (count, 4, window)
 
-                x_current_center = bounds[second][0] + bounds[second][2] / 2
-                y_current_center = bounds[second][1] + bounds[second][3] / 2
+            x, y, w, h = windows[:, 0], windows[:, 1], windows[:, 2], windows[:, 3]
+            valid = ~np.isnan(x)
 
-                # average distance between the centers of the bounding boxes
-                average_distance = 0
-                for time in times_to_average:
-                    x1, y1, w, h = bounds[time]
-                    x_center = x1 + w / 2
-                    y_center = y1 + h / 2
+            x_center = x + w / 2
+            y_center = y + h / 2
+            x_current_center = (boxes[:, 0] + boxes[:, 2] / 2)[:, None]
+            y_current_center = (boxes[:, 1] + boxes[:, 3] / 2)[:, None]
 
-                    average_distance += np.sqrt((x_center - x_current_center)
-                                                ** 2 + (y_center - y_current_center)**2)
+            # half of the summed distance between the centers of the bounding boxes in the window
+            distance = np.sqrt((x_center - x_current_center) ** 2 + (y_center - y_current_center) ** 2)
+            same_person_threshold = np.nansum(distance, axis=1, keepdims=True) / 2
 
-                same_person_threshold = average_distance / 2
+            # ignore boxes that jumped too far away to be the same person
+            same_person = valid & \
+                (np.abs(x_center - x_current_center) <= same_person_threshold) & \
+                (np.abs(y_center - y_current_center) <= same_person_threshold)
 
-                for time in times_to_average:
-                    x1, y1, w, h = bounds[time]
-                    x_center = x1 + w / 2
-                    y_center = y1 + h / 2
+            averaged = np.where(same_person[:, None, :], windows, 0).sum(axis=2) / same_person.sum(axis=1)[:, None]
 
-                    if abs(x_center - x_current_center) > same_person_threshold or \
-                            abs(y_center - y_current_center) > same_person_threshold:
-                        continue
-
-                    x_values.append(x1)
-                    y_values.append(y1)
-                    w_values.append(w)
-                    h_values.append(h)
-
-                x_mean = np.mean(x_values)
-                y_mean = np.mean(y_values)
-                w_mean = np.mean(w_values)
-                h_mean = np.mean(h_values)
-
-                bounds[times_to_average[0]] = [x_mean, y_mean, w_mean, h_mean]
+            boxes_all = track.boxes.copy()
+            boxes_all[index] = averaged
+            track.set_boxes(boxes_all)
 
     def smooth_bounds(self):
         if self.smoothing <= 0.0:
@@ -202,31 +561,18 @@ class PersonTracker:
         alpha = self.smoothing  # Smoothing factor. Adjust this to increase or decrease smoothing
 
         for key in self.people.keys():
-            bounds = self.people[key]['bounds']
-            seconds = self.people[key]['seconds']
-            ema_bounds = {}
-
-            sorted_seconds = sorted(seconds)
-            if sorted_seconds:
-                ema_bounds[sorted_seconds[0]] = bounds[sorted_seconds[0]]
+            track = self.people[key]
+            index = track.unique_times()
+            boxes = track.boxes[index]
 
-            for i in range(1, len(sorted_seconds)):
-                current_time = sorted_seconds[i]
-                previous_time = sorted_seconds[i - 1]
-
-                previous_bounds = ema_bounds[previous_time]
-                current_bounds = bounds[current_time]
-
-                x1, y1, w, h = current_bounds
-                prev_x, prev_y, prev_w, prev_h = previous_bounds
-
-                # Calculate the exponential moving average
-                x_mean = alpha * x1 + (1 - alpha) * prev_x
-                y_mean = alpha * y1 + (1 - alpha) * prev_y
-                w_mean = alpha * w + (1 - alpha) * prev_w
-                h_mean = alpha * h + (1 - alpha) * prev_h
+            if len(boxes) == 0:
+                continue
 
-                ema_bounds[current_time] = [x_mean, y_mean, w_mean, h_mean]
+            # exponential moving average, ema[i] = alpha * box[i] + (1 - alpha) * ema[i - 1], seeded with the first box
+            ema_boxes, _ = scipy.signal.lfilter(
+                [alpha], [1, alpha - 1], boxes, axis=0, zi=(1 - alpha) * boxes[:1])
 
             # Update the original bounds with the smoothed values
-            bounds.update(ema_bounds)
+            boxes_all = track.boxes.copy()
+            boxes_all[index] = ema_boxes
+            track.set_boxes(boxes_all)
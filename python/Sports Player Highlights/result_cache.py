@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+import tempfile
+
+# An append only cache of EyePop results, keyed by the content of the video and the pop that inferred it.
+#   Every result is one json line that is flushed as soon as it is written, so a crash loses at most the line
+#   being written and an interrupted analysis can resume after the last persisted timestamp.
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """ Returns the blake2b hex digest of the content of the file at `path`. """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as file:
+        while chunk := file.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def text_hash(text):
+    return hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+
+
+class ResultCache:
+
+    COMPLETE = {'complete': True}
+
+    def __init__(self, cache_dir, video_path, pop_definition, fsync_every=100):
+        """
+        Args:
+            cache_dir (str): The folder holding the cache files.
+            video_path (str): The analyzed video, its content is part of the cache key.
+            pop_definition (str): Everything that changes the results of the pop, eg. the pop comp and its models.
+            fsync_every (int): Results written between fsyncs, every line is flushed regardless.
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.cache_dir = cache_dir
+        self.key = self._video_hash(video_path) + '_' + text_hash(pop_definition)
+        self.path = os.path.join(cache_dir, self.key + '.ndjson')
+        self.fsync_every = fsync_every
+
+        self.complete = False
+        self.last_seconds = None
+        self.file = None
+        self.unsynced = 0
+
+    def _video_hash(self, video_path):
+        """ Hashing a full game takes a while, so the digest is remembered for the file's size and mtime. """
+        index_path = os.path.join(self.cache_dir, 'hashes.json')
+        index = {}
+        try:
+            with open(index_path, "r") as index_file:
+                index = json.load(index_file)
+        except (OSError, ValueError):
+            # missing or unreadable, the digests are recomputed and the index rewritten
+            index = {}
+        if not isinstance(index, dict):
+            index = {}
+
+        stat = os.stat(video_path)
+        entry = index.get(os.path.abspath(video_path))
+        if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            return entry['digest']
+
+        digest = file_hash(video_path)
+        index[os.path.abspath(video_path)] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'digest': digest}
+        # written next to the index and renamed over it, so a crash never leaves a torn index behind
+        handle, temp_path = tempfile.mkstemp(prefix="hashes_", suffix=".json", dir=self.cache_dir)
+        try:
+            with os.fdopen(handle, "w") as index_file:
+                json.dump(index, index_file)
+            os.replace(temp_path, index_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        return digest
+
+    def read(self):
+        """
+        Yields the cached results. A torn last line left by a crash is dropped from the file, so appending
+        continues from the last complete result.
+        """
+        if not os.path.exists(self.path):
+            return
+
+        valid_size = 0
+        with open(self.path, "rb") as cache_file:
+            for line in cache_file:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete line")
+                    result = json.loads(line)
+                except ValueError:
+                    break
+
+                valid_size += len(line)
+
+                if result == self.COMPLETE:
+                    self.complete = True
+                    continue
+
+                self.last_seconds = result['seconds']
+                yield result
+
+        if valid_size != os.path.getsize(self.path):
+            with open(self.path, "r+b") as cache_file:
+                cache_file.truncate(valid_size)
+
+    def append(self, result):
+        if self.file is None:
+            self.file = open(self.path, "a")
+
+        self.file.write(json.dumps(result, separators=(',', ':')))
+        self.file.write("\n")
+        self.file.flush()
+
+        self.unsynced += 1
+        if self.unsynced >= self.fsync_every:
+            os.fsync(self.file.fileno())
+            self.unsynced = 0
+
+        if 'seconds' in result:
+            self.last_seconds = result['seconds']
+
+    def mark_complete(self):
+        self.append(self.COMPLETE)
+        self.complete = True
+
+    def close(self):
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            self.file = None
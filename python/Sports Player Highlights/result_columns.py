@@ -0,0 +1,199 @@
+import numpy as np
+
+# Flattens EyePop results into typed arrays with one row per detected object, so filtering people, measuring
+#   ball distances and expanding boxes are array operations instead of dict lookups per object.
+
+
+class ResultColumns:
+
+    def __init__(self, seconds, class_ids, confidences, boxes, trace_ids, label_rows, label_ids, class_labels, labels,
+                 source_width=0, source_height=0, label_confidences=None):
+        """
+        Args:
+            seconds (array): float64, the frame time of each object.
+            class_ids (array): int32, index of each object's classLabel in `class_labels`.
+            confidences (array): float32, the confidence of each object.
+            boxes (array): float64 (n, 4), the [x, y, w, h] of each object.
+            trace_ids (array): int64, the trace id of each object, -1 when it has none.
+            label_rows (array): int64, the object row of each text label read on a person.
+            label_ids (array): int32, index of each text label in `labels`.
+            class_labels (list): The distinct class labels.
+            labels (list): The distinct text labels.
+            source_width (int): The width of the video.
+            source_height (int): The height of the video.
+            label_confidences (array): float32, the OCR confidence of each text label, 1 when it has none.
+        """
+        self.seconds = seconds
+        self.class_ids = class_ids
+        self.confidences = confidences
+        self.boxes = boxes
+        self.trace_ids = trace_ids
+        self.label_rows = label_rows
+        self.label_ids = label_ids
+        self.class_labels = class_labels
+        self.labels = labels
+        self.source_width = source_width
+        self.source_height = source_height
+        self.label_confidences = np.ones(len(label_rows), dtype=np.float32) if label_confidences is None \
+            else label_confidences
+
+    def __len__(self):
+        return len(self.seconds)
+
+    def class_mask(self, class_label):
+        """ A boolean mask of the rows of `class_label`. """
+        if class_label not in self.class_labels:
+            return np.zeros(len(self), dtype=bool)
+        return self.class_ids == self.class_labels.index(class_label)
+
+    def _label_rows(self, rows):
+        """ The label rows numbered by their position in the sorted `rows`, and which labels are kept. """
+        if rows is None:
+            return self.label_rows, slice(None)
+
+        position = np.searchsorted(rows, self.label_rows)
+        kept = (position < len(rows)) & (rows[np.minimum(position, len(rows) - 1)] == self.label_rows)
+        return position[kept], kept
+
+    def labels_by_row(self, rows=None):
+        """
+        Maps each object row with text labels to the list of its labels, in the order they were read.
+        With sorted `rows`, only the labels of those rows are mapped and they are numbered by their position in `rows`.
+        """
+        label_rows, kept = self._label_rows(rows)
+
+        labels_by_row = {}
+        for row, label_id in zip(label_rows.tolist(), self.label_ids[kept].tolist()):
+            labels_by_row.setdefault(row, []).append(self.labels[label_id])
+        return labels_by_row
+
+    def label_confidences_by_row(self, rows=None):
+        """ The confidences of the labels of labels_by_row, in the same order. """
+        label_rows, kept = self._label_rows(rows)
+
+        confidences_by_row = {}
+        for row, confidence in zip(label_rows.tolist(), self.label_confidences[kept].tolist()):
+            confidences_by_row.setdefault(row, []).append(confidence)
+        return confidences_by_row
+
+
+def parse_results(results):
+    """ Flattens an iterable of EyePop results into ResultColumns, this is the only pass over the result dicts. """
+    seconds = []
+    class_ids = []
+    confidences = []
+    boxes = []
+    trace_ids = []
+    label_rows = []
+    label_ids = []
+    label_confidences = []
+    class_index = {}
+    label_index = {}
+    source_width = 0
+    source_height = 0
+
+    # bound appends, this loop runs once per detected object
+    add_second = seconds.append
+    add_class_id = class_ids.append
+    add_confidence = confidences.append
+    add_box = boxes.append
+    add_trace_id = trace_ids.append
+
+    for result in results:
+
+        source_width = result['source_width']
+        source_height = result['source_height']
+
+        # skip any empty results
+        if 'objects' not in result:
+            continue
+
+        frame_time = result['seconds']
+
+        for obj in result['objects']:
+            class_label = obj['classLabel']
+            class_id = class_index.get(class_label)
+            if class_id is None:
+                class_id = class_index[class_label] = len(class_index)
+
+            add_second(frame_time)
+            add_class_id(class_id)
+            add_confidence(obj.get('confidence', 1.0))
+            add_box((obj['x'], obj['y'], obj['width'], obj['height']))
+            add_trace_id(obj.get('traceId', -1))
+
+            # grab the jersey labels read on the person
+            if class_label != 'person' or 'objects' not in obj:
+                continue
+
+            row = len(seconds) - 1
+            for child in obj['objects']:
+                if child['classLabel'] == 'text' and 'labels' in child:
+                    for label in child['labels']:
+                        label_rows.append(row)
+                        label_ids.append(label_index.setdefault(label['label'], len(label_index)))
+                        label_confidences.append(label.get('confidence', 1.0))
+
+    return ResultColumns(
+        seconds=np.array(seconds, dtype=np.float64),
+        class_ids=np.array(class_ids, dtype=np.int32),
+        confidences=np.array(confidences, dtype=np.float32),
+        boxes=np.array(boxes, dtype=np.float64).reshape(-1, 4),
+        trace_ids=np.array(trace_ids, dtype=np.int64),
+        label_rows=np.array(label_rows, dtype=np.int64),
+        label_ids=np.array(label_ids, dtype=np.int32),
+        class_labels=list(class_index),
+        labels=list(label_index),
+        source_width=source_width,
+        source_height=source_height,
+        label_confidences=np.array(label_confidences, dtype=np.float32),
+    )
+
+
+def iter_columns(results, batch_size=512):
+    """ Parses a stream of results into ResultColumns of up to `batch_size` results each, as they arrive. """
+    batch = []
+    for result in results:
+        batch.append(result)
+        if len(batch) == batch_size:
+            yield parse_results(batch)
+            batch = []
+
+    if batch:
+        yield parse_results(batch)
+
+
+def ball_distances(boxes, ball_boxes, source_width, source_height):
+    """
+    The euclidean distance between the centers of each box and its ball box, in coordinates normalized by the
+    video size. -1 where there is no ball, ie. the ball box is nan.
+    """
+    size = np.array([source_width, source_height], dtype=np.float64)
+    centers = (boxes[:, :2] + boxes[:, 2:] / 2) / size
+    ball_centers = (ball_boxes[:, :2] + ball_boxes[:, 2:] / 2) / size
+
+    distances = np.linalg.norm(centers - ball_centers, axis=1)
+    return np.where(np.isnan(distances), -1.0, distances)
+
+
+def expand_to_ball(boxes, ball_boxes):
+    """ Grows each box to also contain its ball box, boxes without a ball (nan) are returned unchanged. """
+    min_xy = np.fmin(boxes[:, :2], ball_boxes[:, :2])
+    max_xy = np.fmax(boxes[:, :2] + boxes[:, 2:], ball_boxes[:, :2] + ball_boxes[:, 2:])
+    return np.concatenate([min_xy, max_xy - min_xy], axis=1)
+
+
+def add_to_tracker(person_tracker, columns):
+    """ Adds the people in `columns` to the person tracker, in the order they were detected. """
+    persons = columns.class_mask('person')
+
+    # if there is no trace id and no label, we ignore the person
+    has_label = np.zeros(len(columns), dtype=bool)
+    has_label[columns.label_rows] = True
+    rows = np.flatnonzero(persons & ((columns.trace_ids != -1) | has_label))
+
+    labels_by_row = columns.labels_by_row(rows)
+    confidences_by_row = columns.label_confidences_by_row(rows)
+
+    person_tracker.add_people(columns.seconds[rows], columns.trace_ids[rows], columns.boxes[rows], labels_by_row,
+                              confidences_by_row)
@@ -0,0 +1,172 @@
+import numpy as np
+
+# Builds the highlight segments of a player by scoring every second they are on screen, instead of using every
+#   second they appear in. Seconds score higher the more the player has or is near the ball, moves and fills the
+#   frame. The best scoring seconds are padded, merged and capped to a total duration per player. Players without
+#   a tracked ball, or without a second scoring high enough, fall back to the seconds they appear in, capped the
+#   same way.
+
+DEFAULT_WEIGHTS = {
+    'possession': 0.5,
+    'proximity': 0.25,
+    'motion': 0.15,
+    'size': 0.1,
+}
+
+
+def score_timeline(seconds, boxes, ball_distance, has_ball, source_width, source_height, weights=DEFAULT_WEIGHTS,
+                   bin_size=1.0, proximity_range=0.3, motion_scale=0.25, size_scale=0.5):
+    """
+    Scores every `bin_size` seconds of a player's sorted detections between 0 and 1.
+
+    Args:
+        seconds (array): The sorted detection times.
+        boxes (array): (n, 4) the [x, y, w, h] of each detection.
+        ball_distance (array): The normalized distance to the ball of each detection, -1 without a ball. None when
+            the ball was not tracked, the ball features are then left out of the score.
+        has_ball (array): Whether the player was closest to the ball at each detection.
+        source_width (int): The width of the video.
+        source_height (int): The height of the video.
+        weights (dict): The weight of each of the 'possession', 'proximity', 'motion' and 'size' features.
+        bin_size (float): The length of each scored bin in seconds.
+        proximity_range (float): The normalized ball distance at which proximity scores 0.
+        motion_scale (float): The speed, in frame widths per second, at which motion scores 1.
+        size_scale (float): The box height, as a fraction of the frame, at which size scores 1.
+
+    Returns:
+        (array, array): The start time of each bin and its score.
+    """
+    start = np.floor(seconds[0] / bin_size) * bin_size
+    bins = ((seconds - start) // bin_size).astype(np.int64)
+    bin_count = bins[-1] + 1
+
+    count = np.bincount(bins, minlength=bin_count)
+    present = count > 0
+    per_bin = np.maximum(count, 1)
+
+    def bin_mean(values):
+        return np.bincount(bins, weights=values, minlength=bin_count) / per_bin
+
+    features = {}
+
+    if ball_distance is not None and np.any(ball_distance >= 0):
+        closeness = np.where(ball_distance >= 0, np.clip(1 - ball_distance / proximity_range, 0, 1), 0)
+        features['possession'] = bin_mean(has_ball.astype(np.float64))
+        features['proximity'] = bin_mean(closeness)
+
+    # the speed of the box center between consecutive detections, counted in the bin of the later one
+    centers = (boxes[:, :2] + boxes[:, 2:] / 2) / np.array([source_width, source_width], dtype=np.float64)
+    elapsed = np.diff(seconds)
+    step = np.linalg.norm(np.diff(centers, axis=0), axis=1)
+    speed = np.divide(step, elapsed, out=np.zeros_like(step), where=elapsed > 0)
+    features['motion'] = bin_mean(np.clip(np.concatenate(([0.0], speed)) / motion_scale, 0, 1))
+
+    features['size'] = bin_mean(np.clip(boxes[:, 3] / source_height / size_scale, 0, 1))
+
+    # without a tracked ball the remaining weights are scaled up to keep the score between 0 and 1
+    total_weight = sum(weights[name] for name in features)
+    score = sum(weights[name] * feature for name, feature in features.items()) / max(total_weight, 1e-9)
+
+    return start + bin_size * np.arange(bin_count), np.where(present, score, 0.0)
+
+
+def build_segments(bin_starts, scores, bin_size=1.0, threshold=0.3, pad=1.0, merge_gap=2.0, max_duration=60.0,
+                   limits=None):
+    """
+    Turns the bin scores into (start, end) segments.
+
+    The runs of bins scoring at least `threshold` are padded by `pad` seconds on both sides, runs less than
+    `merge_gap` seconds apart are merged, and the best scoring segments are kept until they add up to
+    `max_duration` seconds. The segments are clamped to the (first, last) times in `limits`.
+    """
+    hot = np.concatenate(([0], (scores >= threshold).astype(np.int8), [0]))
+    edges = np.diff(hot)
+    run_starts = np.flatnonzero(edges == 1)
+    run_ends = np.flatnonzero(edges == -1)
+
+    if len(run_starts) == 0:
+        return []
+
+    starts = bin_starts[run_starts] - pad
+    ends = bin_starts[run_ends - 1] + bin_size + pad
+
+    if limits is not None:
+        starts = np.clip(starts, limits[0], limits[1])
+        ends = np.clip(ends, limits[0], limits[1])
+
+    # merge the runs that overlap or nearly touch, the runs are already in time order
+    new_group = np.concatenate(([True], starts[1:] > np.maximum.accumulate(ends)[:-1] + merge_gap))
+    group_starts = np.flatnonzero(new_group)
+    starts = starts[group_starts]
+    ends = np.maximum.reduceat(ends, group_starts)
+
+    # rank the segments by their mean score
+    score_sums = np.concatenate(([0.0], np.cumsum(scores)))
+    first_bin = np.searchsorted(bin_starts, starts, side='right') - 1
+    last_bin = np.searchsorted(bin_starts, ends, side='left')
+    first_bin = np.clip(first_bin, 0, len(scores))
+    last_bin = np.clip(last_bin, first_bin + 1, len(scores))
+    mean_scores = (score_sums[last_bin] - score_sums[first_bin]) / (last_bin - first_bin)
+
+    # keep the best segments within the duration budget, trimming the one that crosses it
+    order = np.argsort(-mean_scores, kind='stable')
+    durations = (ends - starts)[order]
+    budget_before = np.concatenate(([0.0], np.cumsum(durations)[:-1]))
+    kept_durations = np.clip(max_duration - budget_before, 0, durations)
+
+    kept = order[kept_durations >= min(bin_size, max_duration)]
+    ends[order] = starts[order] + kept_durations
+    kept = np.sort(kept)
+
+    return [(float(start), float(end)) for start, end in zip(starts[kept], ends[kept])]
+
+
+def presence_segments(seconds, gap=2.0):
+    """ The (start, end) segments of the sorted `seconds`, a new segment starts after every gap longer than `gap`. """
+    gaps = np.flatnonzero(np.diff(seconds) > gap)
+    starts = seconds[np.concatenate(([0], gaps + 1))]
+    ends = seconds[np.concatenate((gaps, [len(seconds) - 1]))]
+
+    return [(float(start), float(end)) for start, end in zip(starts, ends)]
+
+
+def cap_segments(segments, max_duration=60.0):
+    """ Keeps the longest of the sorted `segments` until they add up to `max_duration`, trimming the one crossing it. """
+    if not segments:
+        return []
+
+    starts, ends = np.array(segments, dtype=np.float64).T
+    order = np.argsort(starts - ends, kind='stable')
+    durations = (ends - starts)[order]
+    budget_before = np.concatenate(([0.0], np.cumsum(durations)[:-1]))
+    kept_durations = np.clip(max_duration - budget_before, 0, durations)
+
+    kept = np.sort(order[budget_before < max_duration])
+    ends[order] = starts[order] + kept_durations
+
+    return [(float(start), float(end)) for start, end in zip(starts[kept], ends[kept])]
+
+
+def track_segments(track, source_width, source_height, threshold=0.3, pad=1.0, merge_gap=2.0, max_duration=60.0,
+                   weights=DEFAULT_WEIGHTS):
+    """
+    Scores a sorted person_tracker.Track and returns its highlight segments, see build_segments.
+    Without a tracked ball, or when no second scores `threshold`, the scores can't tell the highlights apart, so
+    the seconds the player appears in are returned instead, capped to `max_duration`.
+    """
+    if len(track) == 0:
+        return []
+
+    seconds = track.seconds
+    has_ball_features = track.ball_distance is not None and np.any(track.ball_distance >= 0)
+
+    if has_ball_features:
+        bin_starts, scores = score_timeline(seconds, track.boxes, track.ball_distance, track.has_ball,
+                                            source_width, source_height, weights=weights)
+
+        segments = build_segments(bin_starts, scores, threshold=threshold, pad=pad, merge_gap=merge_gap,
+                                  max_duration=max_duration, limits=(seconds[0], seconds[-1]))
+        if segments:
+            return segments
+
+    return cap_segments(presence_segments(seconds, gap=merge_gap), max_duration)
@@ -0,0 +1,150 @@
+import argparse as ap
+import json
+
+import cv2
+import numpy as np
+
+# Synthetic videos and EyePop shaped results, so the pipeline can be run and benchmarked without a real game or
+#   EyePop credentials.
+
+
+def make_synthetic_video(path, seconds=60, fps=30, resolution=(1920, 1080)):
+    """ Writes a noisy test video with a moving box so the decoder has real work to do. """
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, resolution)
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 255, (resolution[1], resolution[0], 3), dtype=np.uint8)
+
+    for i in range(int(seconds * fps)):
+        frame = np.roll(background, i * 4, axis=1)
+        x = (i * 8) % (resolution[0] - 200)
+        cv2.rectangle(frame, (x, 400), (x + 200, 800), (0, 0, 255), -1)
+        writer.write(frame)
+
+    writer.release()
+
+
+def make_segments(duration, count=10, length=4.0, seed=0):
+    """ Random, sorted (start, end) segments like PersonTracker.filter_times produces. """
+    rng = np.random.default_rng(seed)
+    starts = np.sort(rng.uniform(0, duration - length, count))
+    return [(float(s), float(s + length)) for s in starts]
+
+
+def make_bounds(duration, step=0.1):
+    """ A {time: [x, y, w, h]} track that walks across the frame, as PersonTracker produces. """
+    return {float(t): [200 + 40 * t, 400, 120, 300] for t in np.arange(0, duration, step)}
+
+
+def random_walk(rng, frames, people, low, high, step):
+    """ (frames, people) positions that wander between `low` and `high`, reflecting off both ends. """
+    span = high - low
+    walk = rng.uniform(0, span, people) + np.cumsum(rng.normal(0, step, (frames, people)), axis=0)
+    walk = np.mod(walk, 2 * span)
+    return low + np.where(walk > span, 2 * span - walk, walk)
+
+
+def make_synthetic_results(frames, people=4, fps=30, seed=0, churn=0.02, read_rate=0.3, misread_rate=0.05,
+                           resolution=(1920, 1080)):
+    """
+    EyePop shaped results with `people` players walking around the frame and a sports ball carried by one of them.
+
+    Args:
+        frames (int): The number of results.
+        people (int): The players on screen.
+        fps (float): The frame rate of the results.
+        seed (int): The seed of the random generator.
+        churn (float): The chance per second that a player's trace is lost, they are then hidden for 0.5-2 seconds
+            and come back with a new trace id, like deepsort after an occlusion.
+        read_rate (float): The chance a player's jersey is read in a frame.
+        misread_rate (float): The chance a read is a random, low confidence number instead.
+        resolution (tuple): The size of the video.
+    """
+    rng = np.random.default_rng(seed)
+    width, height = resolution
+    jerseys = [str(number) for number in rng.choice(np.arange(1, 100), people, replace=False)]
+
+    box_heights = rng.uniform(0.2, 0.35, people) * height
+    box_widths = 0.4 * box_heights
+    xs = random_walk(rng, frames, people, 0, width - box_widths.max(), 6.0)
+    ys = random_walk(rng, frames, people, 0, height - box_heights.max(), 3.0)
+
+    # every lost trace hides the player for a moment and gives them a new trace id
+    visible = np.ones((frames, people), dtype=bool)
+    losses = rng.random((frames, people)) < churn / fps
+    for frame, player in zip(*np.nonzero(losses)):
+        visible[frame:frame + int(rng.uniform(0.5, 2.0) * fps), player] = False
+    player_trace_ids = np.cumsum(losses, axis=0) * people + np.arange(people)
+
+    reads = rng.random((frames, people)) < read_rate
+    misreads = rng.random((frames, people)) < misread_rate
+    read_confidences = rng.uniform(0.6, 1.0, (frames, people))
+    misread_labels = rng.integers(1, 100, (frames, people))
+    misread_confidences = rng.uniform(0.1, 0.5, (frames, people))
+
+    # the ball changes hands every few seconds and is missed in some frames
+    carrier = np.repeat(rng.integers(0, people, frames // int(3 * fps) + 1), int(3 * fps))[:frames]
+    ball_seen = rng.random(frames) < 0.9
+
+    results = []
+    for frame in range(frames):
+        objects = []
+        for player in range(people):
+            if not visible[frame, player]:
+                continue
+
+            person = {
+                'classLabel': 'person',
+                'confidence': 0.9,
+                'x': float(xs[frame, player]), 'y': float(ys[frame, player]),
+                'width': float(box_widths[player]), 'height': float(box_heights[player]),
+                'traceId': int(player_trace_ids[frame, player]),
+            }
+            if reads[frame, player]:
+                if misreads[frame, player]:
+                    label = {'label': str(misread_labels[frame, player]),
+                             'confidence': float(misread_confidences[frame, player])}
+                else:
+                    label = {'label': jerseys[player], 'confidence': float(read_confidences[frame, player])}
+                person['objects'] = [{'classLabel': 'text', 'labels': [label]}]
+            objects.append(person)
+
+        player = carrier[frame]
+        if ball_seen[frame] and visible[frame, player]:
+            objects.append({'classLabel': 'sports ball', 'confidence': 0.8,
+                            'x': float(xs[frame, player] + box_widths[player] / 2),
+                            'y': float(ys[frame, player] + box_heights[player] * 0.9),
+                            'width': 20.0, 'height': 20.0})
+
+        results.append({'seconds': frame / fps, 'source_width': width, 'source_height': height, 'objects': objects})
+
+    return results
+
+
+def write_results(results, path):
+    """ Writes the results as a json array when `path` ends in .json, like data.json, otherwise as ndjson. """
+    with open(path, "w") as data_file:
+        if path.endswith(".json"):
+            json.dump(results, data_file)
+            return
+
+        for result in results:
+            data_file.write(json.dumps(result, separators=(',', ':')))
+            data_file.write("\n")
+
+
+if __name__ == '__main__':
+    args = ap.ArgumentParser()
+    args.add_argument("--results", type=str, default='synthetic.ndjson', nargs='?')
+    args.add_argument("--video", type=str, default=None, nargs='?')
+    args.add_argument("--players", type=int, default=10)
+    args.add_argument("--seconds", type=float, default=60)
+    args.add_argument("--fps", type=float, default=30)
+    args.add_argument("--churn", type=float, default=0.02)
+    args.add_argument("--seed", type=int, default=0)
+    args = args.parse_args()
+
+    write_results(make_synthetic_results(int(args.seconds * args.fps), people=args.players, fps=args.fps,
+                                         seed=args.seed, churn=args.churn), args.results)
+
+    if args.video:
+        make_synthetic_video(args.video, seconds=args.seconds, fps=args.fps)
@@ -0,0 +1,52 @@
+import numpy as np
+
+# A sorted, array backed timeline of a player's bounding boxes, used to look up the bounds for video frames
+
+
+class BoundsTimeline:
+
+    def __init__(self, times, boxes):
+        """
+        Args:
+            times (array): The detection times in seconds.
+            boxes (array): One [x, y, w, h] row per detection time.
+        """
+        times = np.asarray(times, dtype=np.float64)
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+        order = np.argsort(times, kind='stable')
+        self.times = times[order]
+        self.boxes = boxes[order]
+
+    @classmethod
+    def from_dict(cls, time_bounds):
+        """ Builds the timeline from a {frame_time: [x, y, w, h]} dict. """
+        return cls(list(time_bounds.keys()), list(time_bounds.values()))
+
+    def __len__(self):
+        return len(self.times)
+
+    def nearest(self, t):
+        """ Returns the [x, y, w, h] rows of the detections closest to each time in `t`. """
+        t = np.asarray(t, dtype=np.float64)
+
+        after = np.clip(np.searchsorted(self.times, t), 1, len(self.times) - 1)
+        before = after - 1
+
+        # ties go to the earlier detection
+        use_after = (self.times[after] - t) < (t - self.times[before])
+        index = np.where(use_after, after, before)
+
+        if len(self.times) == 1:
+            index = np.zeros_like(index)
+
+        return self.boxes[index]
+
+    def interpolate(self, t):
+        """ Returns [x, y, w, h] rows linearly interpolated between the detections around each time in `t`. """
+        t = np.asarray(t, dtype=np.float64)
+        return np.stack([np.interp(t, self.times, self.boxes[:, i]) for i in range(4)], axis=-1)
+
+    def at_times(self, t, interpolate=True):
+        """ Batched lookup of the bounds for every time in `t`, eg. all frame times of a segment. """
+        return self.interpolate(t) if interpolate else self.nearest(t)
@@ -1,5 +1,62 @@
 # 2D geometry functions
 # currently does rectangle operations, hash tag get_rect
+#   the batch functions at the bottom do the same on numpy arrays, one row of [x, y, w, h] per rect
+
+import numpy as np
+
+class Rect:
+	"""
+	An integer rectangle. The edges, center and dims are derived from x, y, w and h, and rect['left'] style access
+	still works for code written against the dict rects.
+	"""
+	__slots__ = ('x', 'y', 'w', 'h')
+
+	def __init__(self, x, y, w, h):
+		self.x = x
+		self.y = y
+		self.w = w
+		self.h = h
+
+	@property
+	def left(self):
+		return self.x
+
+	@property
+	def right(self):
+		return self.x + self.w
+
+	@property
+	def top(self):
+		return self.y
+
+	@property
+	def bottom(self):
+		return self.y + self.h
+
+	@property
+	def center_x(self):
+		return self.x + self.w // 2
+
+	@property
+	def center_y(self):
+		return self.y + self.h // 2
+
+	@property
+	def min_dim(self):
+		return min(self.w, self.h)
+
+	@property
+	def max_dim(self):
+		return max(self.w, self.h)
+
+	def __getitem__(self, key):
+		return getattr(self, key)
+
+	def __eq__(self, other):
+		return isinstance(other, Rect) and (self.x, self.y, self.w, self.h) == (other.x, other.y, other.w, other.h)
+
+	def __repr__(self):
+		return f"Rect(x={self.x}, y={self.y}, w={self.w}, h={self.h})"
 
 def get_rect(x=None, y=None, center_x=None, center_y=None, w=1, h=1):
 	w = int(w)
@@ -7,27 +64,10 @@ def get_rect(x=None, y=None, center_x=None, center_y=None, w=1, h=1):
 	if x is not None and y is not None:
 		x = int(x)
 		y = int(y)
-		center_x = x + w // 2
-		center_y = y + h // 2
 	elif center_x is not None and center_y is not None:
-		center_x = int(center_x)
-		center_y = int(center_y)
-		x = center_x - w // 2
-		y = center_y - h // 2
-	return {
-		'x': x,
-		'y': y,
-		'w': w,
-		'h': h,
-		'left': x,
-		'right': x + w,
-		'top': y,
-		'bottom': y + h,
-		'center_x': center_x,
-		'center_y': center_y,
-		'min_dim': min(w, h),
-		'max_dim': max(w, h)
-	}
+		x = int(center_x) - w // 2
+		y = int(center_y) - h // 2
+	return Rect(x, y, w, h)
 
 def get_rect_clamped_inside_another_rect(center_x, center_y, w, h, outer_rect):
 	center_x = max(center_x, outer_rect['left'] + w // 2) #  keep inside outer_rect left edge
@@ -47,3 +87,42 @@ def to_slice(rect):
 
 def to_corners(rect):
 	return (rect['left'], rect['top']), (rect['right'], rect['bottom'])
+
+def get_rects(x=None, y=None, center_x=None, center_y=None, w=1, h=1):
+	""" The batch get_rect, returns a (n, 4) int array of [x, y, w, h] rows. Values truncate like int(). """
+	w = np.trunc(w).astype(np.int64)
+	h = np.trunc(h).astype(np.int64)
+	if x is not None and y is not None:
+		x = np.trunc(x).astype(np.int64)
+		y = np.trunc(y).astype(np.int64)
+	else:
+		x = np.trunc(center_x).astype(np.int64) - w // 2
+		y = np.trunc(center_y).astype(np.int64) - h // 2
+	return np.stack(np.broadcast_arrays(x, y, w, h), axis=-1)
+
+def _edges(rects):
+	""" The left, right, top and bottom of a Rect or of every row of a rect array. """
+	if isinstance(rects, Rect):
+		return rects.left, rects.right, rects.top, rects.bottom
+	x, y, w, h = rects[:, 0], rects[:, 1], rects[:, 2], rects[:, 3]
+	return x, x + w, y, y + h
+
+def get_rects_clamped_inside_another_rect(center_x, center_y, w, h, outer_rects):
+	""" The batch get_rect_clamped_inside_another_rect, `outer_rects` is a Rect or a rect array with a row per rect. """
+	w = np.asarray(w)
+	h = np.asarray(h)
+	left, right, top, bottom = _edges(outer_rects)
+	center_x = np.minimum(np.maximum(center_x, left + w // 2), right - w // 2)
+	center_y = np.minimum(np.maximum(center_y, top + h // 2), bottom - h // 2)
+	return get_rects(center_x=center_x, center_y=center_y, w=w, h=h)
+
+def get_rects_fit_inside_another_rect(inner_w, inner_h, outer_rect):
+	""" The batch get_rect_fit_inside_another_rect, for inner rects of every `inner_w` x `inner_h` size. """
+	inner_w = np.asarray(inner_w, dtype=np.float64)
+	inner_h = np.asarray(inner_h, dtype=np.float64)
+	inner_to_outer_scale = np.minimum(outer_rect['w'] / inner_w, outer_rect['h'] / inner_h)
+	return get_rects(center_x=outer_rect['center_x'], center_y=outer_rect['center_y'], w=inner_w * inner_to_outer_scale, h=inner_h * inner_to_outer_scale)
+
+def to_rects(rects):
+	""" A list of Rect from the rows of a rect array. """
+	return [Rect(x, y, w, h) for x, y, w, h in rects.tolist()]